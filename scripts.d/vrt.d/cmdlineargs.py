@@ -194,6 +194,18 @@ def configure_parser(ext_options):
                      metavar  = "<integer>",
                      dest     = "arg_max_line_length")
 
+    dro.add_argument("--max-highlight-lines",
+                     help     = ("Only highlight line backgrounds, not "
+                                 "changed characters, in diffs longer than "
+                                 "this many lines; 0 means no limit "
+                                 "[default: %(default)s]."),
+                     action   = "store",
+                     type     = int,
+                     default  = 20000,
+                     required = False,
+                     metavar  = "<integer>",
+                     dest     = "arg_max_highlight_lines")
+
     dro.add_argument("--palette",
                      help     = regular_help(ext, ext_options, "palette"),
                      action   = "store",
@@ -424,6 +436,7 @@ def process_command_line():
     options.intraline_percent_ = float(options.arg_intraline_percent) / 100.0
 
     options.arg_max_line_length = max(1, options.arg_max_line_length)
+    options.arg_max_highlight_lines = max(0, options.arg_max_highlight_lines)
 
     if options.arg_dossier_url is not None:
         # Import fetchurl locally to avoid 'requests' module unless
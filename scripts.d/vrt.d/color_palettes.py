@@ -37,9 +37,20 @@ class ColorPalette:
     def __init__(self, name, colors):
         self.name = name
         self.colors = colors
+        self._qcolors = {}  # color_type -> QColor (or None), built on first use
     
     def get_color(self, color_type):
         """Get QColor for a specific type, returns None if color should not be applied"""
+        try:
+            return self._qcolors[color_type]
+        except KeyError:
+            pass
+        
+        color = self._make_color(color_type)
+        self._qcolors[color_type] = color
+        return color
+    
+    def _make_color(self, color_type):
         if color_type in self.colors:
             color_value = self.colors[color_type]
             if color_value is None:
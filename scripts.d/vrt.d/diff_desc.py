@@ -2,7 +2,20 @@
 # All Rights Reserved.
 # Licensed under Gnu GPL V3.
 #
+import re
+
+_TAB_RUN_RE = re.compile(r'\t+')
+
+
 class TextRun(object):
+    ADD        = 1
+    DELETE     = 2
+    INTRALINE  = 3
+    TRAILINGWS = 4
+    TAB        = 5
+    NOTPRESENT = 6
+    N_KINDS    = 7              # Size of a table indexed by kind_.
+
     def __init__(self, kind, start, n_chars):
         self.start_   = start
         self.len_     = n_chars
@@ -20,7 +33,7 @@ class TextRun(object):
 
 class TextRunAdded(TextRun):
     def __init__(self, start, n_chars):
-        super().__init__(1, start, n_chars)
+        super().__init__(TextRun.ADD, start, n_chars)
 
     def color(self):
         return "ADD"
@@ -28,7 +41,7 @@ class TextRunAdded(TextRun):
 
 class TextRunDeleted(TextRun):
     def __init__(self, start, n_chars):
-        super().__init__(2, start, n_chars)
+        super().__init__(TextRun.DELETE, start, n_chars)
 
     def color(self):
         return "DELETE"
@@ -36,7 +49,7 @@ class TextRunDeleted(TextRun):
 
 class TextRunIntraline(TextRun):
     def __init__(self, start, n_chars):
-        super().__init__(3, start, n_chars)
+        super().__init__(TextRun.INTRALINE, start, n_chars)
 
     def color(self):
         return "INTRALINE"
@@ -44,14 +57,14 @@ class TextRunIntraline(TextRun):
 
 class TextRunTrailingWhitespace(TextRun):
     def __init__(self, start, n_chars):
-        super().__init__(4, start, n_chars)
+        super().__init__(TextRun.TRAILINGWS, start, n_chars)
 
     def color(self):
         return "TRAILINGWS"
 
 class TextRunTab(TextRun):
     def __init__(self, start, n_chars):
-        super().__init__(5, start, n_chars)
+        super().__init__(TextRun.TAB, start, n_chars)
 
     def color(self):
         return "TAB"
@@ -59,21 +72,16 @@ class TextRunTab(TextRun):
 
 class TextRunNotPresent(TextRun):
     def __init__(self, start, n_chars):
-        super().__init__(6, start, n_chars)
+        super().__init__(TextRun.NOTPRESENT, start, n_chars)
 
     def color(self):
         return "NOTPRESENT"
 
 
-class TextRunUnknown(TextRun):  # XXX Remove with diffmgr.
-    def __init__(self, start, n_chars):
-        super().__init__(7, start, n_chars)
-
-    def color(self):
-        return "UNKNOWN"        # Unknown meta marker on '? ' command.
-
-
 class Line(object):
+    __slots__ = ("line_", "line_num_", "runs_added_", "runs_deleted_",
+                 "runs_intraline_", "runs_tws_", "runs_tabs_", "region_")
+
     def __init__(self, line):
         assert(isinstance(line, str))
         self.line_           = line     # Text of source line.
@@ -115,10 +123,34 @@ class Line(object):
         return "LINE"
 
 
-class NotPresent(Line):         # Line doesn't exist in this file.
+class UnchangedLine(Line):      # Line without intraline changes.
+    # Most lines of a diff are in equal regions, so these are made by
+    # the thousand.  Rather than five fresh run lists each, they hold
+    # the (shared, never modified) tuples of their text's tab and
+    # trailing whitespace runs, and a shared empty tuple for the rest.
+    __slots__ = ()
+
+    NO_RUNS = ()
+
+    def __init__(self, line, runs_tabs, runs_tws):
+        assert(isinstance(line, str))
+        self.line_           = line
+        self.line_num_       = -1
+        self.runs_added_     = self.NO_RUNS
+        self.runs_deleted_   = self.NO_RUNS
+        self.runs_intraline_ = self.NO_RUNS
+        self.runs_tws_       = runs_tws
+        self.runs_tabs_      = runs_tabs
+        self.region_         = None
+
+
+class NotPresent(UnchangedLine): # Line doesn't exist in this file.
+    # A placeholder is made for every line deleted from, or added to,
+    # the other file; being empty, it shares the empty run tuple.
+    __slots__ = ()
+
     def __init__(self):
-        super().__init__("")
-        run = TextRunNotPresent(0, len(self.line_))
+        super().__init__("", self.NO_RUNS, self.NO_RUNS)
 
     def show_line_number(self):
         return False
@@ -128,6 +160,8 @@ class NotPresent(Line):         # Line doesn't exist in this file.
 
 
 class NotPresentAdd(NotPresent):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
 
@@ -136,6 +170,8 @@ class NotPresentAdd(NotPresent):
 
 
 class NotPresentDelete(NotPresent):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
 
@@ -201,6 +237,13 @@ class LineInfoDesc(object):
         idx = len(self.regions_) - 1 # Index to most recently opened region.
         line.add_parent_region(self.regions_[idx])
 
+    def add_lines(self, lines):
+        # Same as add_line() on each of lines, in order.
+        region = self.regions_[len(self.regions_) - 1]
+        for line in lines:
+            line.region_ = region
+        self.lines_.extend(lines)
+
 class DiffDesc(object):
     def __init__(self, verbose, intraline_percent):
         self.verbose_           = verbose
@@ -254,6 +297,55 @@ class DiffDesc(object):
             line.dump("modi")
         self.modi_.add_line(line)
 
+    def add_line_pair(self, base, modi):
+        # Equivalent to cache_base(base), cache_modi(modi),
+        # flush(0, False, None), which is how every line pair is added.
+        # Called once per line, so unless the flush must be traced,
+        # do it without the chain of per-line method calls.
+        if self.verbose_:
+            self.cache_base(base)
+            self.cache_modi(modi)
+            self.flush(0, False, None)
+            return
+
+        cl = self.cl_
+        base.line_num_ = cl.base_line_
+        self.base_.add_line(base)
+        if base.show_line_number():
+            cl.base_line_ += 1
+
+        modi.line_num_ = cl.modi_line_
+        self.modi_.add_line(modi)
+        if modi.show_line_number():
+            cl.modi_line_ += 1
+
+    def add_line_pairs(self, bases, modis):
+        # Equivalent to add_line_pair() on each (bases[i], modis[i]),
+        # for a whole region of lines at once.
+        assert(len(bases) == len(modis))
+        if self.verbose_:
+            for (base, modi) in zip(bases, modis):
+                self.add_line_pair(base, modi)
+            return
+
+        cl = self.cl_
+        base_line = cl.base_line_
+        for base in bases:
+            base.line_num_ = base_line
+            if base.show_line_number():
+                base_line += 1
+        cl.base_line_ = base_line
+
+        modi_line = cl.modi_line_
+        for modi in modis:
+            modi.line_num_ = modi_line
+            if modi.show_line_number():
+                modi_line += 1
+        cl.modi_line_ = modi_line
+
+        self.base_.add_lines(bases)
+        self.modi_.add_lines(modis)
+
     def cache_modi(self, line):
         assert(isinstance(line, Line))
         self.cl_.modi_ = line
@@ -329,49 +421,16 @@ class DiffDesc(object):
 
 def find_tab_runs(line, r_beg, r_len):
     assert(isinstance(line, Line))
-    tab_runs = [ ]
-    l_start  = r_beg  # Original r_beg to create TextRunTab.
-    line     = line.line_[r_beg:r_beg + r_len]
-    tab_idxs = [i for i, c in enumerate(line) if c == '\t']
-
-    # inv: tab_idxs contains all indicies in 'line' that are '\t'.
-    #      It can be empty.
-    t_idx = 0
-    r_beg = t_idx
-    r_end = 0
-    if len(tab_idxs) > 0:
-        while t_idx < len(tab_idxs):
-            r_beg = tab_idxs[t_idx]
-            r_end = r_beg + 1
-            if t_idx + 1 < len(tab_idxs):
-                if tab_idxs[t_idx + 1] == r_end:
-                    # Multiple tabs.  Accumulate them.
-                    t_idx += 1
-                    while (t_idx < len(tab_idxs) and
-                           tab_idxs[t_idx] == r_end):
-                        r_end += 1
-                        t_idx += 1
-                else:
-                    # Single tab.
-                    t_idx += 1
-            else:
-                # End of line, or single tab.
-                t_idx += 1
-
-            t_run = TextRunTab(l_start + r_beg, r_end - r_beg)
-            tab_runs.append(t_run)
-
-    return tab_runs
+    # Each maximal run of tabs in line.line_[r_beg:r_beg + r_len]; the
+    # regex scans in C, and its spans are already line relative.
+    return [TextRunTab(m.start(), m.end() - m.start())
+            for m in _TAB_RUN_RE.finditer(line.line_, r_beg, r_beg + r_len)]
 
 
 def find_trailing_whitespace(line):
     assert(isinstance(line, Line))
 
-    idx = len(line.line_)
-    beg = idx
-    while idx > 0 and line.line_[idx - 1] in (' ', '\t'):
-        beg = idx - 1
-        idx -= 1
+    beg = len(line.line_.rstrip(' \t'))
 
     if beg < len(line.line_):
         return [ TextRunTrailingWhitespace(beg, len(line.line_) - beg) ]
@@ -8,6 +8,11 @@ DiffViewer main class for diff_review
 This module contains the main DiffViewer window class that orchestrates
 the entire diff viewing application.
 """
+import array
+import bisect
+import contextlib
+import itertools
+import re
 import sys
 from typing import Optional
 from PyQt6.QtWidgets import (QApplication, QWidget, QVBoxLayout,
@@ -15,22 +20,176 @@ from PyQt6.QtWidgets import (QApplication, QWidget, QVBoxLayout,
                               QMessageBox, QDialog, QPushButton)
 from PyQt6.QtCore import Qt, QTimer
 from PyQt6.QtGui import (QColor, QFont, QTextCursor, QAction, QFontMetrics,
-                         QTextCharFormat, QTextBlockFormat, QPainter, QPen)
+                         QTextCharFormat, QTextBlockFormat, QTextFormat, QPainter, QPen)
 
 from utils import extract_display_path
 from search_dialogs import SearchDialog, SearchResultDialog
 from ui_components import LineNumberArea, DiffMapWidget, SyncedPlainTextEdit
 import color_palettes
+import diff_desc
 from tab_content_base import TabContentBase
 
 
+# Region kinds, bound once for the per-line paths
+_EQUAL = diff_desc.RegionDesc.EQUAL
+_DELETE = diff_desc.RegionDesc.DELETE
+_ADD = diff_desc.RegionDesc.ADD
+_CHANGE = diff_desc.RegionDesc.CHANGE
+
+# Change region tag for each non-EQUAL region kind
+_REGION_TAG = {
+    _DELETE: 'delete',
+    _ADD: 'insert',
+    _CHANGE: 'replace'
+}
+
+# Palette color key for each TextRun kind that is painted
+_RUN_COLOR_KEY = {
+    diff_desc.TextRun.ADD: 'add_run',
+    diff_desc.TextRun.DELETE: 'delete_run',
+    diff_desc.TextRun.INTRALINE: 'intraline_run',
+    diff_desc.TextRun.TRAILINGWS: 'TRAILINGWS',
+    diff_desc.TextRun.TAB: 'TAB'
+}
+
+
+# Formats with no properties, used to clear formatting of ignored runs
+_CLEAR_BLOCK_FORMAT = QTextBlockFormat()
+_CLEAR_CHAR_FORMAT = QTextCharFormat()
+
+# Background-only formats, keyed by the color's rgba(); Qt copies a
+# format when it is applied, so one instance per color is shared
+_block_formats = {}
+_char_formats = {}
+
+
+def background_block_format(color):
+    """Return a QTextBlockFormat with color as its background"""
+    block_fmt = _block_formats.get(color.rgba())
+    if block_fmt is None:
+        block_fmt = _block_formats[color.rgba()] = QTextBlockFormat()
+        block_fmt.setBackground(color)
+    return block_fmt
+
+
+def background_char_format(color):
+    """Return a QTextCharFormat with color as its background"""
+    fmt = _char_formats.get(color.rgba())
+    if fmt is None:
+        fmt = _char_formats[color.rgba()] = QTextCharFormat()
+        fmt.setBackground(color)
+    return fmt
+
+
+def is_whole_line_run(run_start, run_len, line_text):
+    """True if a run of run_len characters from run_start covers all of line_text.
+    
+    Such runs are applied to, or cleared from, the line's block format
+    rather than its characters.
+    """
+    return run_start == 0 and run_len >= len(line_text)
+
+
+def block_has_background(block, color):
+    """True if block's format already has color as its background"""
+    block_fmt = block.blockFormat()
+    return (block_fmt.hasProperty(QTextFormat.Property.BackgroundBrush) and
+            block_fmt.background().color() == color)
+
+
+def build_line_num_index(line_nums):
+    """Map each line number in line_nums to the list of its indices"""
+    index = {}
+    for i, line_num in enumerate(line_nums):
+        if line_num is not None:
+            index.setdefault(line_num, []).append(i)
+    return index
+
+
+def set_document_lines(text_widget, lines, chunk_lines=4096):
+    """Replace the text of text_widget with lines, one block per line.
+    
+    Equivalent to setPlainText('\\n'.join(lines)), but only one chunk of
+    lines is ever joined into a single string.
+    """
+    doc = text_widget.document()
+    doc.setPlainText('')
+    cursor = QTextCursor(doc)
+    cursor.beginEditBlock()
+    try:
+        for pos in range(0, len(lines), chunk_lines):
+            text = '\n'.join(lines[pos:pos + chunk_lines])
+            if pos > 0:
+                text = '\n' + text
+            cursor.insertText(text)
+    finally:
+        cursor.endEditBlock()
+    
+    # Inserting at the widget's cursor carried it to the end; put it back
+    # at the start, where setPlainText() leaves it
+    text_widget.moveCursor(QTextCursor.MoveOperation.Start)
+
+
+def plan_line_runs(line_obj, ignored_kinds):
+    """Split the runs of line_obj into runs to clear and runs to paint.
+    
+    Runs of an ignored kind have their formatting cleared.  The remaining
+    runs are returned in paint priority order: ADD, DELETE, INTRALINE,
+    then TRAILINGWS and TAB (which never overlap).
+    """
+    added = line_obj.runs_added_
+    deleted = line_obj.runs_deleted_
+    intraline = line_obj.runs_intraline_
+    tws = line_obj.runs_tws_
+    tabs = line_obj.runs_tabs_
+    
+    # Most lines of a diff have no runs at all
+    if not (added or deleted or intraline or tws or tabs):
+        return (), ()
+    
+    clear_runs = [run
+                  for runs in (intraline, tws, tabs)
+                  for run in runs if ignored_kinds[run.kind_]]
+    paint_runs = [run
+                  for runs in (added, deleted, intraline, tws, tabs)
+                  for run in runs if not ignored_kinds[run.kind_]]
+    return clear_runs, paint_runs
+
+
+def plan_highlight(line_objects, line_nums, region_kinds, line_indices, bg_for_kind, ignored_kinds):
+    """Decide how each line of one side is highlighted, without touching Qt.
+    
+    line_nums and region_kinds are the per-line columns kept by DiffViewer
+    for the same side as line_objects.  If ignored_kinds is None, only
+    line backgrounds are planned; no runs are cleared or painted.
+    
+    Returns a list of (line_idx, is_placeholder, bg_color, clear_runs,
+    paint_runs) tuples, one per index in line_indices, for
+    DiffViewer.play_highlight_plan() to apply to the document.
+    """
+    plan = []
+    for line_idx in line_indices:
+        if line_nums[line_idx] is None:
+            plan.append((line_idx, True, None, None, None))
+            continue
+        
+        bg_color = bg_for_kind.get(region_kinds[line_idx])
+        if ignored_kinds is None:
+            clear_runs, paint_runs = (), ()
+        else:
+            clear_runs, paint_runs = plan_line_runs(line_objects[line_idx], ignored_kinds)
+        plan.append((line_idx, False, bg_color, clear_runs, paint_runs))
+    return plan
+
+
 class DiffViewer(QWidget, TabContentBase):
     def __init__(self,
                  base_file: str,
                  modified_file: str,
                  max_line_length: int,
                  show_diff_map: bool,
-                 show_line_numbers: bool):
+                 show_line_numbers: bool,
+                 max_highlight_lines: int):
         if QApplication.instance() is None:
             self._app = QApplication(sys.argv)
         else:
@@ -43,6 +202,7 @@ class DiffViewer(QWidget, TabContentBase):
         self.max_line_length = max_line_length
         self.show_diff_map = show_diff_map
         self.show_line_numbers = show_line_numbers
+        self.max_highlight_lines = max_highlight_lines  # 0: no limit
         self.note_count = 0
         
         self.base_noted_lines = set()
@@ -53,28 +213,58 @@ class DiffViewer(QWidget, TabContentBase):
         self.modified_display = []
         self.base_line_nums = []
         self.modified_line_nums = []
+        self._base_display_lower = None  # Lazily built for case-insensitive search
+        self._modified_display_lower = None  # Lazily built for case-insensitive search
+        self._base_display_lower_bytes = None  # ASCII-encoded _base_display_lower, None for non-ASCII lines
+        self._modified_display_lower_bytes = None  # ASCII-encoded _modified_display_lower, None for non-ASCII lines
+        self._bad_regexes = set()  # Search patterns known not to compile
+        self._base_line_num_index = None  # Lazily built: line number -> indices in base_line_nums
+        self._modified_line_num_index = None  # Lazily built: line number -> indices in modified_line_nums
         self.change_regions = []
+        self._region_starts = []  # Start line of each change region, for bisect
+        self._line_to_region = array.array('i')  # Per line: index of its change region, or -1
         self.base_line_objects = []
         self.modified_line_objects = []
+        self.base_region_kinds = []  # Per line: kind_ of the base line's region
+        self.modified_region_kinds = []  # Per line: kind_ of the modified line's region
+        self.base_blocks = []  # Per line: QTextBlock in base_text, set by populate_content
+        self.modified_blocks = []  # Per line: QTextBlock in modified_text, set by populate_content
+        self._base_is_delete = []  # Per line: base line is in a DELETE region
+        self._modified_is_add = []  # Per line: modified line is in an ADD region
         self.n_changed_regions = 0  # Count of non-EQUAL regions from diff descriptor
         
         self.current_region = 0
         self.current_region_highlight = None
         self._target_region = None
+        
+        # Scrolling updates the diff map and current region at most once
+        # per burst of scrollbar changes
+        self._scroll_update_timer = QTimer(self)
+        self._scroll_update_timer.setSingleShot(True)
+        self._scroll_update_timer.setInterval(8)
+        self._scroll_update_timer.timeout.connect(self._do_scroll_update)
         self.ignore_ws = False  # Will be set by tab manager
         self.ignore_tab = False  # Will be set by tab manager
         self.ignore_trailing_ws = False  # Will be set by tab manager
         self.ignore_intraline = False  # Will be set by tab manager
         self.highlighting_applied = False  # Deferred until tab becomes visible
-        self.highlighting_in_progress = False  # True during background highlighting
-        self.highlighting_next_line = 0  # Next line to highlight
+        self._highlighted_lines = set()  # Line indices already highlighted
+        # Every colored format applied so far, in application order, as
+        # (side, line_idx, start, length, color_key); length None is a
+        # block format, and start None too a line number area background.
+        # Lets refresh_colors() recolor without re-planning.
+        self._format_plan = []
         self._needs_highlighting_update = False  # Set by tab_manager for deferred updates
         self._needs_color_refresh = False  # Set by tab_manager for deferred color updates
         
         self.current_font_size = 12  # Default font size
         
-        self.collapsed_regions = []  # List of (start_line, end_line, region_type) tuples for collapsed change regions
+        # Collapsed change regions as parallel lists, sorted by start line
+        self._collapsed_starts = []  # First line of each collapsed region
+        self._collapsed_ends = []  # Last line (inclusive) of each collapsed region
+        self._collapsed_types = []  # 'deleted' or 'added' for each collapsed region
         self.all_collapsed = False  # Track if all change regions are collapsed
+        self._bulk_marking = False  # Inside bulk_marking(): noted lines repaint on exit
         
         self._syncing_scroll = False  # Prevent recursion in scroll syncing
         
@@ -152,6 +342,11 @@ class DiffViewer(QWidget, TabContentBase):
         modified_container.setLayout(modified_layout)
         content_layout.addWidget(modified_container, 1)
         
+        # Cursors used for every highlighting edit; QTextCursors follow
+        # their document's edits, so one per document is reused throughout
+        self._base_edit_cursor = QTextCursor(self.base_text.document())
+        self._modified_edit_cursor = QTextCursor(self.modified_text.document())
+        
         self.line_numbers_visible = self.show_line_numbers
         if not self.show_line_numbers:
             self.base_line_area.hide()
@@ -209,6 +404,7 @@ class DiffViewer(QWidget, TabContentBase):
         text_font = QFont("Courier", 12, QFont.Weight.Bold)
         self.base_text.setFont(text_font)
         self.modified_text.setFont(text_font)
+        self._line_height = self.base_text.fontMetrics().height()  # Refreshed when the font changes
         
         # Install event filters to handle all events centrally
         self.base_text.installEventFilter(self)
@@ -231,11 +427,44 @@ class DiffViewer(QWidget, TabContentBase):
         self.modified_line_nums.append(modi_num)
         self.base_line_objects.append(base)
         self.modified_line_objects.append(modi)
+        self.base_region_kinds.append(base.region_.kind_ if base.region_ is not None else _EQUAL)
+        self.modified_region_kinds.append(modi.region_.kind_ if modi.region_ is not None else _EQUAL)
+    
+    def clear_lines(self):
+        """Discard all lines, before adding a new set with add_line()"""
+        self.base_display = []
+        self.modified_display = []
+        self.base_line_nums = []
+        self.modified_line_nums = []
+        self.change_regions = []
+        self._region_starts = []
+        self._line_to_region = array.array('i')
+        self.base_line_objects = []
+        self.modified_line_objects = []
+        self.base_region_kinds = []
+        self.modified_region_kinds = []
+        self.base_blocks = []
+        self.modified_blocks = []
+        # Collapsed regions refer to the lines being discarded
+        self._collapsed_starts = []
+        self._collapsed_ends = []
+        self._collapsed_types = []
+        self.all_collapsed = False
+        self.base_text.collapsed_markers = {}
+        self.modified_text.collapsed_markers = {}
     
     def finalize(self):
+        self._base_display_lower = None
+        self._modified_display_lower = None
+        self._base_display_lower_bytes = None
+        self._modified_display_lower_bytes = None
+        self._base_line_num_index = None
+        self._modified_line_num_index = None
+        self._format_plan = []  # Recorded against the blocks being replaced
         self.build_change_regions()
+        self.build_collapse_flags()
         self.populate_content()
-        # NOTE: apply_highlighting() is deferred until tab becomes visible
+        # NOTE: highlighting is deferred until tab becomes visible
         # This is handled by ensure_highlighting_applied() called from on_tab_changed()
         self.update_status()
         QTimer.singleShot(100, self.init_scrollbars)
@@ -259,256 +488,257 @@ class DiffViewer(QWidget, TabContentBase):
         """Build change regions from line.region_ references (only non-EQUAL regions)"""
         self.change_regions = []
         
-        import diff_desc
+        line_to_region = array.array('i', [-1]) * len(self.base_region_kinds)
         
-        region_start = None
-        region_kind = None
+        # Run-length encode the region kind of each base line; every run
+        # of a non-EQUAL kind is a change region
+        pos = 0
+        for kind, group in itertools.groupby(self.base_region_kinds):
+            n = sum(1 for _ in group)
+            if kind != _EQUAL:
+                tag_name = _REGION_TAG.get(kind, 'unknown')
+                line_to_region[pos:pos + n] = array.array('i', [len(self.change_regions)]) * n
+                self.change_regions.append((tag_name, pos, pos + n, 0, 0, 0, 0))
+            pos += n
         
-        for i, base_line in enumerate(self.base_line_objects):
-            # Get the region from the line object
-            if base_line.region_:
-                current_kind = base_line.region_.kind_
-                
-                # Only track non-EQUAL regions
-                if current_kind != diff_desc.RegionDesc.EQUAL:
-                    if region_start is None or region_kind != current_kind:
-                        # Start new region
-                        if region_start is not None:
-                            # Close previous region
-                            tag_name = {
-                                diff_desc.RegionDesc.DELETE: 'delete',
-                                diff_desc.RegionDesc.ADD: 'insert',
-                                diff_desc.RegionDesc.CHANGE: 'replace'
-                            }.get(region_kind, 'unknown')
-                            self.change_regions.append((tag_name, region_start, i, 0, 0, 0, 0))
-                        
-                        region_start = i
-                        region_kind = current_kind
-                else:
-                    # EQUAL region - close any open region
-                    if region_start is not None:
-                        tag_name = {
-                            diff_desc.RegionDesc.DELETE: 'delete',
-                            diff_desc.RegionDesc.ADD: 'insert',
-                            diff_desc.RegionDesc.CHANGE: 'replace'
-                        }.get(region_kind, 'unknown')
-                        self.change_regions.append((tag_name, region_start, i, 0, 0, 0, 0))
-                        region_start = None
-                        region_kind = None
-        
-        # Close final region if open
-        if region_start is not None:
-            tag_name = {
-                diff_desc.RegionDesc.DELETE: 'delete',
-                diff_desc.RegionDesc.ADD: 'insert',
-                diff_desc.RegionDesc.CHANGE: 'replace'
-            }.get(region_kind, 'unknown')
-            self.change_regions.append((tag_name, region_start, len(self.base_line_objects), 0, 0, 0, 0))
+        self._line_to_region = line_to_region
+        
+        self._region_starts = [start for _, start, *_ in self.change_regions]
+    
+    def build_collapse_flags(self):
+        """Extract per-line DELETE/ADD flags used to discover collapsible regions"""
+        self._base_is_delete = [kind == _DELETE for kind in self.base_region_kinds]
+        self._modified_is_add = [kind == _ADD for kind in self.modified_region_kinds]
     
     def populate_content(self):
         self.base_line_area.set_line_numbers(self.base_line_nums)
         self.modified_line_area.set_line_numbers(self.modified_line_nums)
         
-        self.base_text.setPlainText('\n'.join(self.base_display))
-        self.modified_text.setPlainText('\n'.join(self.modified_display))
-        
-        # Store QTextBlock references in line objects for fast highlighting
-        for i, line_obj in enumerate(self.base_line_objects):
-            block = self.base_text.document().findBlockByNumber(i)
-            line_obj.text_block_ = block
+        set_document_lines(self.base_text, self.base_display)
+        set_document_lines(self.modified_text, self.modified_display)
         
-        for i, line_obj in enumerate(self.modified_line_objects):
-            block = self.modified_text.document().findBlockByNumber(i)
-            line_obj.text_block_ = block
+        # Store QTextBlock references for fast highlighting
+        base_doc = self.base_text.document()
+        modified_doc = self.modified_text.document()
+        self.base_blocks = [base_doc.findBlockByNumber(i) for i in range(len(self.base_line_objects))]
+        self.modified_blocks = [modified_doc.findBlockByNumber(i) for i in range(len(self.modified_line_objects))]
         
         # Defer diff_map update until highlighting starts
         # self.diff_map.set_change_regions(self.change_regions, len(self.base_display))
     
-    def apply_highlighting(self):
-        import diff_desc
-        palette = color_palettes.get_current_palette()
-        
-        for i, (base_line, modi_line) in enumerate(zip(self.base_line_objects,
-                                                        self.modified_line_objects)):
-            
-            # BASE SIDE
-            if not base_line.show_line_number():
-                # Placeholder line
-                self.highlight_line(self.base_text, i, palette.get_color('placeholder'))
-            else:
-                # Determine background color based on region type
-                bg_color = None
-                
-                if base_line.region_:
-                    region_kind = base_line.region_.kind_
-                    
-                    if region_kind == diff_desc.RegionDesc.DELETE or \
-                       region_kind == diff_desc.RegionDesc.CHANGE:
-                        bg_color = palette.get_color('base_changed_bg')
-                    # EQUAL and ADD regions don't get background on base side
-                
-                if bg_color:
-                    self.highlight_line(self.base_text, i, bg_color)
-                    self.base_line_area.set_line_background(i, bg_color)
-                
-                # Always apply runs
-                self.apply_runs(self.base_text, i, base_line)
-            
-            # MODIFIED SIDE
-            if not modi_line.show_line_number():
-                # Placeholder line
-                self.highlight_line(self.modified_text, i, palette.get_color('placeholder'))
-            else:
-                # Determine background color based on region type
-                bg_color = None
-                
-                if modi_line.region_:
-                    region_kind = modi_line.region_.kind_
-                    
-                    if region_kind == diff_desc.RegionDesc.ADD or \
-                       region_kind == diff_desc.RegionDesc.CHANGE:
-                        bg_color = palette.get_color('modi_changed_bg')
-                    # EQUAL and DELETE regions don't get background on modi side
-                
-                if bg_color:
-                    self.highlight_line(self.modified_text, i, bg_color)
-                    self.modified_line_area.set_line_background(i, bg_color)
-                
-                # Always apply runs
-                self.apply_runs(self.modified_text, i, modi_line)
-        
     def ensure_highlighting_applied(self):
-        """Start progressive highlighting if not yet done."""
-        if not self.highlighting_applied and not self.highlighting_in_progress:
-            self.start_progressive_highlighting()
+        """Start highlighting if not yet done."""
+        if not self.highlighting_applied:
+            self.start_highlighting()
     
-    def start_progressive_highlighting(self):
-        """Start background highlighting in chunks."""
+    def start_highlighting(self):
+        """Highlight the lines around the viewport.
+        
+        Lines are only ever highlighted as they come into view, by
+        update_diff_map_viewport(); lines never shown are never edited.
+        """
         # Update diff_map now that we're rendering
         self.diff_map.set_change_regions(self.change_regions, len(self.base_display))
         
-        self.highlighting_in_progress = True
-        self.highlighting_next_line = 0
-        self.update_highlighting_status()
-        QTimer.singleShot(0, self.highlight_next_chunk)
+        self._highlighted_lines = set()
+        self._format_plan = []
+        self.highlighting_applied = True
+        self.update_diff_map_viewport()  # Highlights the lines around the viewport
+        self.clear_highlighting_status()
     
-    def highlight_next_chunk(self):
-        """Highlight next chunk of lines with batch formatting for performance."""
-        if not self.highlighting_in_progress:
-            return
+    def highlight_range(self, start_line, end_line):
+        """Highlight lines in [start_line, end_line) that are not yet highlighted."""
+        start_line = max(start_line, 0)
+        end_line = min(end_line, len(self.base_line_objects))
+        highlighted = self._highlighted_lines
         
-        chunk_size = 1000  # Increased from 500 for better throughput
-        start_line = self.highlighting_next_line
-        end_line = min(start_line + chunk_size, len(self.base_line_objects))
+        pending = [i for i in range(start_line, end_line) if i not in highlighted]
+        if not pending:
+            return
         
-        import diff_desc
+        # Resolve all colors once for the whole range
         palette = color_palettes.get_current_palette()
+        placeholder_color = palette.get_color('placeholder')
+        base_changed_bg = palette.get_color('base_changed_bg')
+        modi_changed_bg = palette.get_color('modi_changed_bg')
+        # EQUAL and ADD regions don't get background on base side
+        base_bg_for_kind = {_DELETE: base_changed_bg, _CHANGE: base_changed_bg}
+        # EQUAL and DELETE regions don't get background on modi side
+        modi_bg_for_kind = {_ADD: modi_changed_bg, _CHANGE: modi_changed_bg}
+        run_colors = self.resolve_run_colors(palette)
+        if self.run_highlighting_suppressed():
+            ignored_kinds = None  # Backgrounds only
+        else:
+            ignored_kinds = self.ignored_run_kinds()
+        
+        base_plan = plan_highlight(self.base_line_objects, self.base_line_nums, self.base_region_kinds,
+                                   pending, base_bg_for_kind, ignored_kinds)
+        modi_plan = plan_highlight(self.modified_line_objects, self.modified_line_nums, self.modified_region_kinds,
+                                   pending, modi_bg_for_kind, ignored_kinds)
         
-        # Begin edit block for base text widget - batches all operations into single repaint
-        base_cursor = self.base_text.textCursor()
-        base_cursor.beginEditBlock()
+        self.play_highlight_plan(self.base_text, self.base_line_area, self.base_blocks, base_plan,
+                                 placeholder_color, run_colors)
+        self.play_highlight_plan(self.modified_text, self.modified_line_area, self.modified_blocks, modi_plan,
+                                 placeholder_color, run_colors)
         
-        # Begin edit block for modified text widget
-        modi_cursor = self.modified_text.textCursor()
-        modi_cursor.beginEditBlock()
+        self._record_format_plan(0, self.base_blocks, base_plan, 'base_changed_bg', run_colors)
+        self._record_format_plan(1, self.modified_blocks, modi_plan, 'modi_changed_bg', run_colors)
+        
+        highlighted.update(pending)
+    
+    def play_highlight_plan(self, text_widget, line_area, blocks, plan, placeholder_color, run_colors):
+        """Apply a plan from plan_highlight() to text_widget's document"""
+        # Edit block batches all operations into single repaint
+        cursor = self._edit_cursor(text_widget)
+        cursor.beginEditBlock()
         
         try:
-            for i in range(start_line, end_line):
-                base_line = self.base_line_objects[i]
-                modi_line = self.modified_line_objects[i]
+            for line_idx, is_placeholder, bg_color, clear_runs, paint_runs in plan:
+                block = blocks[line_idx]
+                if is_placeholder:
+                    self.highlight_line(text_widget, line_idx, placeholder_color, block, cursor)
+                    continue
                 
-                # BASE SIDE
-                if not base_line.show_line_number():
-                    self.highlight_line(self.base_text, i, palette.get_color('placeholder'), base_line)
-                else:
-                    bg_color = None
-                    if base_line.region_:
-                        region_kind = base_line.region_.kind_
-                        if region_kind == diff_desc.RegionDesc.DELETE or \
-                           region_kind == diff_desc.RegionDesc.CHANGE:
-                            bg_color = palette.get_color('base_changed_bg')
-                    
-                    if bg_color:
-                        self.highlight_line(self.base_text, i, bg_color, base_line)
-                        self.base_line_area.set_line_background(i, bg_color)
-                    
-                    self.apply_runs(self.base_text, i, base_line)
+                if bg_color:
+                    self.highlight_line(text_widget, line_idx, bg_color, block, cursor)
+                    line_area.set_line_background(line_idx, bg_color)
                 
-                # MODIFIED SIDE
-                if not modi_line.show_line_number():
-                    self.highlight_line(self.modified_text, i, palette.get_color('placeholder'), modi_line)
-                else:
-                    bg_color = None
-                    if modi_line.region_:
-                        region_kind = modi_line.region_.kind_
-                        if region_kind == diff_desc.RegionDesc.ADD or \
-                           region_kind == diff_desc.RegionDesc.CHANGE:
-                            bg_color = palette.get_color('modi_changed_bg')
-                    
-                    if bg_color:
-                        self.highlight_line(self.modified_text, i, bg_color, modi_line)
-                        self.modified_line_area.set_line_background(i, bg_color)
-                    
-                    self.apply_runs(self.modified_text, i, modi_line)
+                self._apply_planned_runs(text_widget, block, cursor,
+                                         clear_runs, paint_runs, run_colors)
         finally:
-            # End edit blocks - triggers single repaint for each widget
-            base_cursor.endEditBlock()
-            modi_cursor.endEditBlock()
+            cursor.endEditBlock()
+    
+    def _record_format_plan(self, side, blocks, plan, changed_bg_key, run_colors):
+        """Append the colored formats left by play_highlight_plan() to self._format_plan"""
+        record = self._format_plan.append
+        for line_idx, is_placeholder, bg_color, clear_runs, paint_runs in plan:
+            if is_placeholder:
+                record((side, line_idx, 0, None, 'placeholder'))
+                continue
+            
+            if bg_color:
+                record((side, line_idx, None, None, changed_bg_key))
+                # _apply_planned_runs() removes the background again
+                # when it clears an ignored whole-line run.
+                line_text = blocks[line_idx].text()
+                if not any(is_whole_line_run(run.start_, run.len_, line_text)
+                           for run in clear_runs):
+                    record((side, line_idx, 0, None, changed_bg_key))
+            
+            for run in paint_runs:
+                if run_colors[run.kind_] is not None:
+                    record((side, line_idx, run.start_, run.len_, _RUN_COLOR_KEY[run.kind_]))
+    
+    def recolor_highlighting(self):
+        """Reapply the recorded formats with colors from the current palette.
         
-        self.highlighting_next_line = end_line
+        Only the colors change; the regions and runs, and so the
+        document's format structure, are as they were first highlighted.
+        Lines not yet highlighted pick up the current palette when reached.
+        """
+        palette = color_palettes.get_current_palette()
+        colors = {}
+        sides = ((self.base_text, self.base_line_area, self.base_blocks),
+                 (self.modified_text, self.modified_line_area, self.modified_blocks))
+        cursors = []
+        for text_widget, line_area, blocks in sides:
+            cursor = self._edit_cursor(text_widget)
+            cursor.beginEditBlock()
+            cursors.append(cursor)
         
-        if end_line >= len(self.base_line_objects):
-            # Done
-            self.highlighting_in_progress = False
-            self.highlighting_applied = True
-            self.clear_highlighting_status()
-        else:
-            # Continue
-            self.update_highlighting_status()
-            QTimer.singleShot(0, self.highlight_next_chunk)
-    
-    def update_highlighting_status(self):
-        """Update status bar with highlighting progress."""
-        if not self.highlighting_in_progress:
-            return
-        total = len(self.base_line_objects)
-        current = self.highlighting_next_line
-        percent = int((current / total) * 100) if total > 0 else 0
-        self.highlighting_label.setText(f"  Highlighting: {percent}% ({current}/{total} lines)")
+        try:
+            for side, line_idx, start, length, color_key in self._format_plan:
+                color = colors.get(color_key)
+                if color is None:
+                    color = colors[color_key] = palette.get_color(color_key)
+                
+                text_widget, line_area, blocks = sides[side]
+                if start is None:
+                    line_area.line_backgrounds[line_idx] = color
+                    continue
+                
+                block = blocks[line_idx]
+                if length is None:
+                    self.highlight_line(text_widget, line_idx, color, block, cursors[side])
+                    continue
+                
+                doc_length = text_widget.document().characterCount()
+                self._apply_single_run(cursors[side], block, block.position(), doc_length,
+                                       block.text(), start, length, color)
+        finally:
+            for cursor in cursors:
+                cursor.endEditBlock()
+        
+        self.base_line_area.update()
+        self.modified_line_area.update()
     
     def clear_highlighting_status(self):
         """Clear highlighting status message."""
-        self.highlighting_label.setText("")
+        if self.run_highlighting_suppressed():
+            self.highlighting_label.setText(f"  Run highlighting suppressed "
+                                            f"(>{self.max_highlight_lines} lines); "
+                                            f"background only")
+        else:
+            self.highlighting_label.setText("")
+    
+    def run_highlighting_suppressed(self):
+        """True if the diff is too long to highlight changed characters.
+        
+        Above max_highlight_lines, only whole-line backgrounds are applied;
+        the per-run document edits dominate highlighting a large diff.
+        """
+        return 0 < self.max_highlight_lines < len(self.base_line_objects)
     
     def restart_highlighting(self):
-        """Cancel current highlighting and restart from beginning."""
-        self.highlighting_in_progress = False
+        """Forget what has been highlighted, and highlight the viewport anew."""
         self.highlighting_applied = False
-        self.highlighting_next_line = 0
-        self.start_progressive_highlighting()
+        self.start_highlighting()
 
     
-    def highlight_line(self, text_widget, line_num, color, line_obj=None):
+    def highlight_line(self, text_widget, line_num, color, block=None, cursor=None):
         # Use cached QTextBlock if available
-        if line_obj and hasattr(line_obj, 'text_block_'):
-            block = line_obj.text_block_
-        else:
+        if block is None:
             block = text_widget.document().findBlockByNumber(line_num)
         
         if not block.isValid():
             return
         
-        cursor = text_widget.textCursor()
-        cursor.setPosition(block.position())
-        
-        block_fmt = QTextBlockFormat()
-        block_fmt.setBackground(color)
-        cursor.setBlockFormat(block_fmt)
-    
-    def apply_runs(self, text_widget, line_idx, line_obj):
-        # Use cached QTextBlock reference from line object
-        block = line_obj.text_block_ if hasattr(line_obj, 'text_block_') else text_widget.document().findBlockByNumber(line_idx)
+        # Re-highlighting mostly sets the background a line already has
+        if block_has_background(block, color):
+            return
         
+        if cursor is None:
+            cursor = self._edit_cursor(text_widget)
+        cursor.setPosition(block.position())
+        cursor.setBlockFormat(background_block_format(color))
+    
+    def _edit_cursor(self, text_widget):
+        """Return the cursor kept for highlighting edits to text_widget"""
+        if text_widget is self.base_text:
+            return self._base_edit_cursor
+        return self._modified_edit_cursor
+    
+    def resolve_run_colors(self, palette):
+        """Return list indexed by TextRun kind of the QColor to paint, or None"""
+        TextRun = diff_desc.TextRun
+        
+        run_colors = [None] * TextRun.N_KINDS
+        for kind, key in _RUN_COLOR_KEY.items():
+            run_colors[kind] = palette.get_color(key)
+        return run_colors
+    
+    def ignored_run_kinds(self):
+        """Return list indexed by TextRun kind, True if that kind is being ignored"""
+        TextRun = diff_desc.TextRun
+        
+        ignored = [False] * TextRun.N_KINDS
+        ignored[TextRun.INTRALINE] = self.ignore_intraline
+        ignored[TextRun.TRAILINGWS] = self.ignore_trailing_ws
+        ignored[TextRun.TAB] = self.ignore_tab
+        return ignored
+    
+    def _apply_planned_runs(self, text_widget, block, cursor, clear_runs, paint_runs, run_colors):
+        """Clear formatting of clear_runs, then paint paint_runs, on one block"""
         if not block.isValid():
             return
         
@@ -518,94 +748,49 @@ class DiffViewer(QWidget, TabContentBase):
         if block_pos >= doc_length:
             return
         
-        palette = color_palettes.get_current_palette()
         line_text = block.text()
         
-        # Map color names to palette keys
-        color_map = {
-            'ADD': 'add_run',
-            'DELETE': 'delete_run',
-            'INTRALINE': 'intraline_run',
-            'TRAILINGWS': 'TRAILINGWS',
-            'TAB': 'TAB'
-        }
-        
-        # Map color names to ignore flags
-        ignore_map = {
-            'INTRALINE': self.ignore_intraline,
-            'TRAILINGWS': self.ignore_trailing_ws,
-            'TAB': self.ignore_tab
-        }
-        
         # First pass: clear formatting for ignored run types
-        for runs in [line_obj.runs_intraline_, line_obj.runs_tws_, line_obj.runs_tabs_]:
-            if not runs:
-                continue
-                
-            for run in runs:
-                color_name = run.color()
+        for run in clear_runs:
+            # Check if this is a full-line run
+            if is_whole_line_run(run.start_, run.len_, line_text):
+                # Clear block formatting for full-line runs
+                if block_pos < doc_length:
+                    cursor.setPosition(block_pos)
+                    cursor.setBlockFormat(_CLEAR_BLOCK_FORMAT)
+            else:
+                # Clear character formatting for partial-line runs
+                start_pos = block_pos + run.start_
+                end_pos = block_pos + run.start_ + run.len_
                 
-                # If this type is being ignored, clear its formatting
-                if color_name in ignore_map and ignore_map[color_name]:
-                    # Check if this is a full-line run
-                    if run.start_ == 0 and run.len_ >= len(line_text):
-                        # Clear block formatting for full-line runs
-                        cursor = text_widget.textCursor()
-                        if block_pos < doc_length:
-                            cursor.setPosition(block_pos)
-                            block_fmt = QTextBlockFormat()
-                            cursor.setBlockFormat(block_fmt)
-                    else:
-                        # Clear character formatting for partial-line runs
-                        cursor = text_widget.textCursor()
-                        start_pos = block_pos + run.start_
-                        end_pos = block_pos + run.start_ + run.len_
-                        
-                        if start_pos < doc_length:
-                            block_end = block_pos + len(line_text)
-                            end_pos = min(end_pos, block_end, doc_length - 1)
-                            
-                            if end_pos > start_pos:
-                                cursor.setPosition(start_pos)
-                                cursor.setPosition(end_pos, QTextCursor.MoveMode.KeepAnchor)
-                                fmt = QTextCharFormat()
-                                cursor.setCharFormat(fmt)  # Clear formatting
+                if start_pos < doc_length:
+                    block_end = block_pos + len(line_text)
+                    end_pos = min(end_pos, block_end, doc_length - 1)
+                    
+                    if end_pos > start_pos:
+                        cursor.setPosition(start_pos)
+                        cursor.setPosition(end_pos, QTextCursor.MoveMode.KeepAnchor)
+                        cursor.setCharFormat(_CLEAR_CHAR_FORMAT)  # Clear formatting
         
         # Second pass: apply all non-ignored run types in priority order
-        # Lower priority: ADD, DELETE, INTRALINE
-        # Higher priority: TRAILINGWS, TAB (both equal, never overlap)
-        for runs in [line_obj.runs_added_, line_obj.runs_deleted_, 
-                     line_obj.runs_intraline_, line_obj.runs_tws_, line_obj.runs_tabs_]:
-            if not runs:
-                continue
-                
-            for run in runs:
-                color_name = run.color()
-                
-                # Skip if ignoring this type
-                if color_name in ignore_map and ignore_map[color_name]:
-                    continue
-                
-                # Get color from palette
-                if color_name in color_map:
-                    color = palette.get_color(color_map[color_name])
-                    self._apply_single_run(text_widget, block, block_pos, doc_length, line_text, run, color)
-    
-    def _apply_single_run(self, text_widget, block, block_pos, doc_length, line_text, run, color):
-        """Apply formatting for a single run."""
-        if run.start_ == 0 and run.len_ >= len(line_text):
+        for run in paint_runs:
+            # Get color resolved from palette
+            color = run_colors[run.kind_]
+            if color is not None:
+                self._apply_single_run(cursor, block, block_pos, doc_length, line_text,
+                                       run.start_, run.len_, color)
+    
+    def _apply_single_run(self, cursor, block, block_pos, doc_length, line_text, run_start, run_len, color):
+        """Apply formatting for a single run using cursor."""
+        if is_whole_line_run(run_start, run_len, line_text):
             # Full line formatting
-            cursor = text_widget.textCursor()
-            if block_pos < doc_length:
+            if block_pos < doc_length and not block_has_background(block, color):
                 cursor.setPosition(block_pos)
-                block_fmt = QTextBlockFormat()
-                block_fmt.setBackground(color)
-                cursor.setBlockFormat(block_fmt)
+                cursor.setBlockFormat(background_block_format(color))
         else:
             # Partial line formatting
-            cursor = text_widget.textCursor()
-            start_pos = block_pos + run.start_
-            end_pos = block_pos + run.start_ + run.len_
+            start_pos = block_pos + run_start
+            end_pos = block_pos + run_start + run_len
             
             if start_pos < doc_length:
                 block_end = block_pos + len(line_text)
@@ -614,10 +799,7 @@ class DiffViewer(QWidget, TabContentBase):
                 if end_pos > start_pos:
                     cursor.setPosition(start_pos)
                     cursor.setPosition(end_pos, QTextCursor.MoveMode.KeepAnchor)
-                    
-                    fmt = QTextCharFormat()
-                    fmt.setBackground(color)
-                    cursor.mergeCharFormat(fmt)
+                    cursor.mergeCharFormat(background_char_format(color))
     
     def init_scrollbars(self):
         self.v_scrollbar.setMaximum(self.base_text.verticalScrollBar().maximum())
@@ -640,8 +822,7 @@ class DiffViewer(QWidget, TabContentBase):
         self._syncing_scroll = True
         self.v_scrollbar.setValue(value)
         self.modified_text.verticalScrollBar().setValue(value)
-        self.update_diff_map_viewport()
-        self.update_current_region_from_scroll()
+        self._scroll_update_timer.start()
         if self.modified_line_area:
             self.modified_line_area.update()
         self._syncing_scroll = False
@@ -664,8 +845,7 @@ class DiffViewer(QWidget, TabContentBase):
         self._syncing_scroll = True
         self.v_scrollbar.setValue(value)
         self.base_text.verticalScrollBar().setValue(value)
-        self.update_diff_map_viewport()
-        self.update_current_region_from_scroll()
+        self._scroll_update_timer.start()
         if self.base_line_area:
             self.base_line_area.update()
         self._syncing_scroll = False
@@ -684,18 +864,55 @@ class DiffViewer(QWidget, TabContentBase):
     def on_diff_map_wheel(self, event):
         self.base_text.wheelEvent(event)
     
+    def visible_line_count(self):
+        """Number of lines that fit in the text viewport"""
+        line_height = self._line_height
+        return self.base_text.viewport().height() // line_height if line_height > 0 else 10
+    
     def update_diff_map_viewport(self):
         if len(self.base_display) == 0:
             return
         
         block = self.base_text.firstVisibleBlock()
         first_visible = block.blockNumber()
-        
-        viewport_height = self.base_text.viewport().height()
-        line_height = self.base_text.fontMetrics().height()
-        visible_lines = viewport_height // line_height if line_height > 0 else 10
+        visible_lines = self.visible_line_count()
         
         self.diff_map.set_viewport(first_visible, first_visible + visible_lines)
+        
+        # Highlight what is shown, and a margin around it for scrolling
+        if self.highlighting_applied:
+            margin = 200
+            self.highlight_range(first_visible - margin,
+                                 self._shown_lines_end(first_visible, visible_lines) + margin)
+    
+    def _shown_lines_end(self, first, n_rows):
+        """Index after the last line shown in n_rows rows from line first.
+        
+        Lines hidden in collapsed regions take no rows.
+        """
+        end = first + n_rows
+        starts = self._collapsed_starts
+        ends = self._collapsed_ends
+        i = max(bisect.bisect_right(starts, first) - 1, 0)
+        while i < len(starts) and starts[i] < end:
+            hidden_first = max(starts[i] + 1, first)
+            if ends[i] >= hidden_first:
+                end += ends[i] - hidden_first + 1
+            i += 1
+        return end
+    
+    def _find_region_at(self, line):
+        """Return the index of the change region containing line, or None"""
+        if 0 <= line < len(self._line_to_region):
+            i = self._line_to_region[line]
+            if i >= 0:
+                return i
+        return None
+    
+    def _do_scroll_update(self):
+        """Follow a vertical scroll, once the scrollbar has settled"""
+        self.update_diff_map_viewport()
+        self.update_current_region_from_scroll()
     
     def update_current_region_from_scroll(self):
         if self._target_region is not None:
@@ -707,19 +924,16 @@ class DiffViewer(QWidget, TabContentBase):
         block = self.base_text.firstVisibleBlock()
         first_visible = block.blockNumber()
         
-        for i, (tag, start, end, *_) in enumerate(self.change_regions):
-            if start <= first_visible < end:
-                if self.current_region != i:
-                    self.current_region = i
-                    self.update_status()
+        # The region containing first_visible, else the first region after it
+        i = self._find_region_at(first_visible)
+        if i is None:
+            i = bisect.bisect_right(self._region_starts, first_visible)
+            if i == len(self.change_regions):
                 return
         
-        for i, (tag, start, end, *_) in enumerate(self.change_regions):
-            if start > first_visible:
-                if self.current_region != i:
-                    self.current_region = i
-                    self.update_status()
-                return
+        if self.current_region != i:
+            self.current_region = i
+            self.update_status()
     
     def on_double_click(self, event, side):
         # Use NoteManager to take note
@@ -791,8 +1005,9 @@ class DiffViewer(QWidget, TabContentBase):
         
         # Take note using NoteManager
         if note_mgr.take_note(filename, side, selected_line_nums, selected_line_texts, is_commit_msg=False):
-            for line_num in selected_line_nums:
-                self.mark_noted_line(side, line_num)
+            with self.bulk_marking():
+                for line_num in selected_line_nums:
+                    self.mark_noted_line(side, line_num)
             self.note_count += 1
             self.update_status()
     
@@ -802,45 +1017,54 @@ class DiffViewer(QWidget, TabContentBase):
     def mark_noted_line(self, side, line_num):
         if side == 'base':
             self.base_noted_lines.add(line_num)
-            for i, num in enumerate(self.base_line_nums):
-                if num == line_num:
-                    self.base_line_area.mark_noted(i)
-                    # Mark the line with background color in the text widget
-                    self.mark_text_line_noted(self.base_text, i)
+            line_area = self.base_line_area
+            text_widget = self.base_text
         else:
             self.modified_noted_lines.add(line_num)
-            for i, num in enumerate(self.modified_line_nums):
-                if num == line_num:
-                    self.modified_line_area.mark_noted(i)
-                    # Mark the line with background color in the text widget
-                    self.mark_text_line_noted(self.modified_text, i)
+            line_area = self.modified_line_area
+            text_widget = self.modified_text
+        
+        for i in self.line_num_indices(side, line_num):
+            if self._bulk_marking:
+                line_area.noted_lines.add(i)
+            else:
+                line_area.mark_noted(i)
+            # Mark the line with background color in the text widget
+            self.mark_text_line_noted(text_widget, i)
     
     def mark_text_line_noted(self, text_widget, line_idx):
         """Mark a line as noted with a background color"""
         if not hasattr(text_widget, 'noted_lines'):
             text_widget.noted_lines = set()
         text_widget.noted_lines.add(line_idx)
-        text_widget.viewport().update()
+        if not self._bulk_marking:
+            text_widget.viewport().update()
+    
+    @contextlib.contextmanager
+    def bulk_marking(self):
+        """Repaint once, on exit, for all lines marked noted inside"""
+        self._bulk_marking = True
+        try:
+            yield
+        finally:
+            self._bulk_marking = False
+            self.base_line_area.update()
+            self.modified_line_area.update()
+            self.base_text.viewport().update()
+            self.modified_text.viewport().update()
     
     def on_diff_map_click(self, line):
-        found_region = False
-        for i, (tag, start, end, *_) in enumerate(self.change_regions):
-            if start <= line < end:
-                self.current_region = i
-                found_region = True
-                break
-        
-        if not found_region and self.change_regions:
-            min_distance = float('inf')
-            nearest_region = 0
-            
-            for i, (tag, start, end, *_) in enumerate(self.change_regions):
-                distance = abs(start - line)
-                if distance < min_distance:
-                    min_distance = distance
-                    nearest_region = i
-            
-            self.current_region = nearest_region
+        region = self._find_region_at(line)
+        if region is not None:
+            self.current_region = region
+        elif self.change_regions:
+            # Nearest region start: the last one before line or the first
+            # one after it, preferring the earlier on a tie
+            starts = self._region_starts
+            i = bisect.bisect_right(starts, line)
+            if i == len(starts) or (i > 0 and line - starts[i - 1] <= starts[i] - line):
+                i -= 1
+            self.current_region = i
         
         self.center_on_line(line)
         self.highlight_current_region()
@@ -884,28 +1108,25 @@ class DiffViewer(QWidget, TabContentBase):
         if self._target_region is None:
             return
         
-        if not self.change_regions or self._target_region >= len(self.change_regions):
+        if self._target_region >= len(self.change_regions):
             self._target_region = None
             return
         
         _, start, end, *_ = self.change_regions[self._target_region]
         block = self.base_text.firstVisibleBlock()
         first_visible = block.blockNumber()
-        
-        viewport_height = self.base_text.viewport().height()
-        line_height = self.base_text.fontMetrics().height()
-        visible_lines = viewport_height // line_height if line_height > 0 else 10
-        last_visible = first_visible + visible_lines
+        last_visible = first_visible + self.visible_line_count()
         
         if start >= first_visible and start < last_visible:
             self._target_region = None
     
     def next_change(self):
-        if not self.change_regions:
+        n_regions = len(self.change_regions)
+        if not n_regions:
             return
         
-        if self.current_region >= len(self.change_regions) - 1:
-            if len(self.change_regions) == 1:
+        if self.current_region >= n_regions - 1:
+            if n_regions == 1:
                 self._target_region = 0
                 self.current_region = 0
                 _, start, *_ = self.change_regions[0]
@@ -925,11 +1146,12 @@ class DiffViewer(QWidget, TabContentBase):
         QTimer.singleShot(200, self.check_navigation_complete)
     
     def prev_change(self):
-        if not self.change_regions:
+        n_regions = len(self.change_regions)
+        if not n_regions:
             return
         
         if self.current_region <= 0:
-            if len(self.change_regions) == 1:
+            if n_regions == 1:
                 self._target_region = 0
                 self.current_region = 0
                 _, start, *_ = self.change_regions[0]
@@ -1073,6 +1295,7 @@ class DiffViewer(QWidget, TabContentBase):
         # Apply to text widgets
         self.base_text.setFont(text_font)
         self.modified_text.setFont(text_font)
+        self._line_height = self.base_text.fontMetrics().height()
         
         # Apply to line number areas
         self.base_line_area.setFont(text_font)
@@ -1275,57 +1498,27 @@ class DiffViewer(QWidget, TabContentBase):
         super().resizeEvent(event)
         self.update_diff_map_viewport()
     
+    def _is_deleted_line(self, line_idx):
+        """Check if the base line at line_idx is in a DELETE region"""
+        return 0 <= line_idx < len(self._base_is_delete) and self._base_is_delete[line_idx]
+    
+    def _is_added_line(self, line_idx):
+        """Check if the modified line at line_idx is in an ADD region"""
+        return 0 <= line_idx < len(self._modified_is_add) and self._modified_is_add[line_idx]
+    
     def is_change_region(self, line_idx):
         """Check if a line is part of a change region (deleted or added)"""
-        import diff_desc
-        
-        # Check base file for deleted regions
-        if 0 <= line_idx < len(self.base_line_objects):
-            line_obj = self.base_line_objects[line_idx]
-            if line_obj.region_:
-                if line_obj.region_.kind_ == diff_desc.RegionDesc.DELETE:
-                    return True
-        
-        # Check modified file for added regions
-        if 0 <= line_idx < len(self.modified_line_objects):
-            line_obj = self.modified_line_objects[line_idx]
-            if line_obj.region_:
-                if line_obj.region_.kind_ == diff_desc.RegionDesc.ADD:
-                    return True
-        
-        return False
+        return self._is_deleted_line(line_idx) or self._is_added_line(line_idx)
     
     def find_change_region_bounds(self, line_idx):
         """Find the start and end of the change region (deleted or added) containing line_idx"""
-        import diff_desc
-        if not self.is_change_region(line_idx):
-            return None, None
-        
         # Determine which type of region we're in
-        is_deleted = False
-        is_added = False
-        
-        if 0 <= line_idx < len(self.base_line_objects):
-            line_obj = self.base_line_objects[line_idx]
-            if line_obj.region_ and line_obj.region_.kind_ == diff_desc.RegionDesc.DELETE:
-                is_deleted = True
-        
-        if 0 <= line_idx < len(self.modified_line_objects):
-            line_obj = self.modified_line_objects[line_idx]
-            if line_obj.region_ and line_obj.region_.kind_ == diff_desc.RegionDesc.ADD:
-                is_added = True
-        
-        # Helper to check if line is same region type
-        def is_same_region_type(idx):
-            if is_deleted:
-                if 0 <= idx < len(self.base_line_objects):
-                    obj = self.base_line_objects[idx]
-                    return obj.region_ and obj.region_.kind_ == diff_desc.RegionDesc.DELETE
-            elif is_added:
-                if 0 <= idx < len(self.modified_line_objects):
-                    obj = self.modified_line_objects[idx]
-                    return obj.region_ and obj.region_.kind_ == diff_desc.RegionDesc.ADD
-            return False
+        if self._is_deleted_line(line_idx):
+            is_same_region_type = self._is_deleted_line
+        elif self._is_added_line(line_idx):
+            is_same_region_type = self._is_added_line
+        else:
+            return None, None
         
         start = line_idx
         while start > 0 and is_same_region_type(start - 1):
@@ -1340,142 +1533,143 @@ class DiffViewer(QWidget, TabContentBase):
     
     def collapse_change_region(self, line_idx):
         """Collapse the change region (deleted or added) containing line_idx"""
-        import diff_desc
         start, end = self.find_change_region_bounds(line_idx)
         if start is None or end is None:
             return
         
         # Determine region type
         region_type = None
-        if 0 <= line_idx < len(self.base_line_objects):
-            line_obj = self.base_line_objects[line_idx]
-            if line_obj.region_ and line_obj.region_.kind_ == diff_desc.RegionDesc.DELETE:
-                region_type = 'deleted'
+        if self._is_deleted_line(line_idx):
+            region_type = 'deleted'
         
-        if 0 <= line_idx < len(self.modified_line_objects):
-            line_obj = self.modified_line_objects[line_idx]
-            if line_obj.region_ and line_obj.region_.kind_ == diff_desc.RegionDesc.ADD:
-                region_type = 'added'
+        if self._is_added_line(line_idx):
+            region_type = 'added'
         
         if region_type is None:
             return
         
-        region_tuple = (start, end, region_type)
-        if region_tuple in self.collapsed_regions:
+        if self._find_collapsed_region(start) >= 0:
             return
         
-        self.collapsed_regions.append(region_tuple)
+        idx = bisect.bisect_right(self._collapsed_starts, start)
+        self._collapsed_starts.insert(idx, start)
+        self._collapsed_ends.insert(idx, end)
+        self._collapsed_types.insert(idx, region_type)
         self._apply_collapsed_regions()
     
     def collapse_all_change_regions(self):
         """Collapse all change regions (deleted and added)"""
-        import diff_desc
-        
-        # Store tuples of (start, end, 'deleted'/'added') to track which side
-        self.collapsed_regions = []
-        
-        # Process deleted regions in base file
-        in_delete_region = False
-        region_start = None
+        if self.all_collapsed:
+            return
         
-        for i, line_obj in enumerate(self.base_line_objects):
-            is_deleted = (line_obj.region_ and 
-                         line_obj.region_.kind_ == diff_desc.RegionDesc.DELETE)
-            
-            if is_deleted and not in_delete_region:
-                in_delete_region = True
-                region_start = i
-            elif not is_deleted and in_delete_region:
-                self.collapsed_regions.append((region_start, i - 1, 'deleted'))
-                in_delete_region = False
-                region_start = None
-        
-        if in_delete_region and region_start is not None:
-            self.collapsed_regions.append((region_start, len(self.base_line_objects) - 1, 'deleted'))
-        
-        # Process added regions in modified file
-        in_add_region = False
-        region_start = None
-        
-        for i, line_obj in enumerate(self.modified_line_objects):
-            is_added = (line_obj.region_ and 
-                       line_obj.region_.kind_ == diff_desc.RegionDesc.ADD)
-            
-            if is_added and not in_add_region:
-                in_add_region = True
-                region_start = i
-            elif not is_added and in_add_region:
-                self.collapsed_regions.append((region_start, i - 1, 'added'))
-                in_add_region = False
-                region_start = None
+        # Store (start, end, 'deleted'/'added') to track which side
+        regions = []
         
-        if in_add_region and region_start is not None:
-            self.collapsed_regions.append((region_start, len(self.modified_line_objects) - 1, 'added'))
+        # Deleted regions in base file and added regions in modified file,
+        # found in one pass over both sides; regions come out sorted by start
+        pos = 0
+        for (is_deleted, is_added), group in itertools.groupby(zip(self._base_is_delete,
+                                                                   self._modified_is_add)):
+            n = sum(1 for _ in group)
+            if is_deleted:
+                regions.append((pos, pos + n - 1, 'deleted'))
+            elif is_added:
+                regions.append((pos, pos + n - 1, 'added'))
+            pos += n
         
+        self._collapsed_starts = [start for start, end, region_type in regions]
+        self._collapsed_ends = [end for start, end, region_type in regions]
+        self._collapsed_types = [region_type for start, end, region_type in regions]
         self.all_collapsed = True
         self._apply_collapsed_regions()
     
     def uncollapse_region(self, line_idx):
         """Uncollapse the region containing line_idx"""
-        for region in self.collapsed_regions:
-            start, end, region_type = region
-            if start <= line_idx <= end:
-                self.collapsed_regions.remove(region)
-                self._apply_collapsed_regions()
-                return
+        idx = self._find_collapsed_region(line_idx)
+        if idx >= 0:
+            del self._collapsed_starts[idx]
+            del self._collapsed_ends[idx]
+            del self._collapsed_types[idx]
+            self.all_collapsed = False
+            self._apply_collapsed_regions()
     
     def uncollapse_all_regions(self):
         """Uncollapse all regions"""
-        self.collapsed_regions = []
+        self._collapsed_starts = []
+        self._collapsed_ends = []
+        self._collapsed_types = []
         self.all_collapsed = False
         self._apply_collapsed_regions()
     
     def is_line_in_collapsed_region(self, line_idx):
         """Check if line_idx is within any collapsed region"""
-        for start, end, region_type in self.collapsed_regions:
-            if start <= line_idx <= end:
-                return True
-        return False
+        return self._find_collapsed_region(line_idx) >= 0
+    
+    def _find_collapsed_region(self, line_idx):
+        """Return index of the collapsed region containing line_idx, or -1"""
+        idx = bisect.bisect_right(self._collapsed_starts, line_idx) - 1
+        if idx >= 0 and line_idx <= self._collapsed_ends[idx]:
+            return idx
+        return -1
+    
+    @property
+    def collapsed_regions(self):
+        """List of (start_line, end_line, region_type) tuples for collapsed change regions"""
+        return list(zip(self._collapsed_starts, self._collapsed_ends, self._collapsed_types))
     
     def _apply_collapsed_regions(self):
         """Apply the current collapsed regions by hiding blocks"""
         base_doc = self.base_text.document()
         modified_doc = self.modified_text.document()
         
+        # Mark every line inside a collapsed region (but not its first line) as hidden
+        n_blocks = base_doc.blockCount()
+        hidden = bytearray(n_blocks)
+        for start, end in zip(self._collapsed_starts, self._collapsed_ends):
+            end = min(end, n_blocks - 1)
+            if end > start:
+                hidden[start + 1:end + 1] = b'\x01' * (end - start)
+        
+        first_changed = None
+        last_changed = None
+        
         # Update visibility of all blocks
-        for i in range(base_doc.blockCount()):
+        for i in range(n_blocks):
             base_block = base_doc.findBlockByNumber(i)
             modified_block = modified_doc.findBlockByNumber(i)
             
             if not base_block.isValid() or not modified_block.isValid():
                 continue
             
-            should_hide = False
-            
-            # Check if this line is inside a collapsed region (but not the first line)
-            for start, end, region_type in self.collapsed_regions:
-                if start < i <= end:
-                    should_hide = True
-                    break
-            
-            # Set visibility
-            base_block.setVisible(not should_hide)
-            modified_block.setVisible(not should_hide)
+            # Set visibility, tracking the range of blocks that changed
+            visible = not hidden[i]
+            if base_block.isVisible() != visible or modified_block.isVisible() != visible:
+                base_block.setVisible(visible)
+                modified_block.setVisible(visible)
+                if first_changed is None:
+                    first_changed = i
+                last_changed = i
         
         # Store collapsed marker info for painting
         self.base_text.collapsed_markers = {}
         self.modified_text.collapsed_markers = {}
         
-        for start, end, region_type in self.collapsed_regions:
+        for start, end, region_type in zip(self._collapsed_starts,
+                                           self._collapsed_ends,
+                                           self._collapsed_types):
             num_lines = end - start + 1
             
             # Store marker on BOTH sides (so both panes show the marker)
             self.base_text.collapsed_markers[start] = (num_lines, region_type)
             self.modified_text.collapsed_markers[start] = (num_lines, region_type)
         
-        # Update the document layout
-        base_doc.markContentsDirty(0, base_doc.characterCount())
-        modified_doc.markContentsDirty(0, modified_doc.characterCount())
+        # Update the document layout, but only for blocks whose visibility changed
+        if first_changed is not None:
+            self._mark_blocks_dirty(base_doc, first_changed, last_changed)
+            self._mark_blocks_dirty(modified_doc, first_changed, last_changed)
+        
+        # Highlight lines that uncollapsing brought into view
+        self.update_diff_map_viewport()
         
         # Force immediate repaint of the entire viewport
         self.base_text.viewport().repaint()
@@ -1483,9 +1677,23 @@ class DiffViewer(QWidget, TabContentBase):
         self.base_line_area.repaint()
         self.modified_line_area.repaint()
     
+    def _mark_blocks_dirty(self, doc, first, last):
+        """Invalidate the layout of blocks first..last (inclusive) of doc"""
+        first_block = doc.findBlockByNumber(first)
+        last_block = doc.findBlockByNumber(last)
+        if not first_block.isValid() or not last_block.isValid():
+            return
+        
+        start_pos = first_block.position()
+        end_pos = last_block.position() + last_block.length()
+        doc.markContentsDirty(start_pos, end_pos - start_pos)
+    
     def refresh_colors(self):
         """Refresh all colors from the current palette"""
-        self.apply_highlighting()
+        if self._format_plan:
+            self.recolor_highlighting()
+        else:
+            self.restart_highlighting()
         self.diff_map.update()
     
     def has_unsaved_changes(self):
@@ -1508,41 +1716,139 @@ class DiffViewer(QWidget, TabContentBase):
             List of tuples: (side, display_line_num, line_idx, line_text, char_pos)
         """
         results = []
+        results_append = results.append
+        find_matches = self._find_matches_in_line
         
-        # Search in base
-        if search_base:
-            for line_idx, (line_text, line_num) in enumerate(zip(self.base_display, self.base_line_nums)):
-                if line_num is not None:
-                    matches = self._find_matches_in_line(line_text, search_text, case_sensitive, regex)
-                    for char_pos, matched_text in matches:
-                        results.append(('base', line_num, line_idx, line_text, char_pos))
+        pattern = None
+        if regex:
+            if search_text in self._bad_regexes:
+                return results
+            try:
+                pattern = re.compile(search_text, 0 if case_sensitive else re.IGNORECASE)
+            except re.error:
+                self._bad_regexes.add(search_text)
+                return results
+        else:
+            self._bad_regexes.clear()
         
-        # Search in modified
+        sides = []
+        if search_base:
+            sides.append(('base', self.base_display, self.base_line_nums))
         if search_modi:
-            for line_idx, (line_text, line_num) in enumerate(zip(self.modified_display, self.modified_line_nums)):
-                if line_num is not None:
-                    matches = self._find_matches_in_line(line_text, search_text, case_sensitive, regex)
-                    for char_pos, matched_text in matches:
-                        results.append(('modified', line_num, line_idx, line_text, char_pos))
+            sides.append(('modified', self.modified_display, self.modified_line_nums))
+        
+        use_lower = not case_sensitive and not regex
+        
+        # Case-insensitive literal search for ASCII text can run on bytes
+        ascii_needle = None
+        if use_lower and search_text and search_text.isascii():
+            ascii_needle = search_text.lower().encode('ascii')
+        
+        for side, display, line_nums in sides:
+            display_lower = self._get_display_lower(side) if use_lower else display
+            display_bytes = self._get_display_lower_bytes(side) if ascii_needle is not None else None
+            for line_idx in range(len(display)):
+                line_num = line_nums[line_idx]
+                if line_num is None:
+                    continue
+                line_text = display[line_idx]
+                if display_bytes is not None and display_bytes[line_idx] is not None:
+                    matches = self._find_ascii_matches(line_text, display_bytes[line_idx], ascii_needle)
+                else:
+                    matches = find_matches(line_text, search_text, case_sensitive, regex,
+                                           display_lower[line_idx], pattern)
+                for char_pos, matched_text in matches:
+                    results_append((side, line_num, line_idx, line_text, char_pos))
         
         return results
 
-    def _find_matches_in_line(self, line_text, search_text, case_sensitive, regex):
-        """Find all match positions in a line. Returns list of (start_pos, match_text) tuples."""
-        import re
+    def line_num_indices(self, side, line_num):
+        """Return the display line indices showing file line line_num on side"""
+        if side == 'base':
+            if self._base_line_num_index is None:
+                self._base_line_num_index = build_line_num_index(self.base_line_nums)
+            index = self._base_line_num_index
+        else:
+            if self._modified_line_num_index is None:
+                self._modified_line_num_index = build_line_num_index(self.modified_line_nums)
+            index = self._modified_line_num_index
+        return index.get(line_num, ())
+    
+    def _get_display_lower(self, side):
+        """Return lowercased display lines for side, building them on first use"""
+        if side == 'base':
+            if self._base_display_lower is None:
+                self._base_display_lower = [line_text.lower() for line_text in self.base_display]
+            return self._base_display_lower
+        
+        if self._modified_display_lower is None:
+            self._modified_display_lower = [line_text.lower() for line_text in self.modified_display]
+        return self._modified_display_lower
+    
+    def _get_display_lower_bytes(self, side):
+        """Return ASCII-encoded lowercased display lines for side (None for non-ASCII lines)"""
+        if side == 'base':
+            if self._base_display_lower_bytes is None:
+                self._base_display_lower_bytes = [
+                    line_lower.encode('ascii') if line_lower.isascii() else None
+                    for line_lower in self._get_display_lower('base')]
+            return self._base_display_lower_bytes
+        
+        if self._modified_display_lower_bytes is None:
+            self._modified_display_lower_bytes = [
+                line_lower.encode('ascii') if line_lower.isascii() else None
+                for line_lower in self._get_display_lower('modified')]
+        return self._modified_display_lower_bytes
+    
+    @staticmethod
+    def _find_ascii_matches(line_text, line_bytes, needle):
+        """Find all matches of lowercased ASCII needle in the lowercased ASCII form of line_text"""
+        matches = []
+        n = len(needle)
+        find = line_bytes.find
+        pos = find(needle)
+        while pos >= 0:
+            matches.append((pos, line_text[pos:pos + n]))
+            pos = find(needle, pos + n)
+        return matches
+    
+    def _find_matches_in_line(self, line_text, search_text, case_sensitive, regex, line_lower=None, pattern=None):
+        """Find all match positions in a line. Returns list of (start_pos, match_text) tuples.
+        
+        line_lower, if given, is the cached lowercase form of line_text.
+        pattern, if given, is search_text already compiled for regex searches.
+        """
         matches = []
         
         if regex:
-            try:
-                flags = 0 if case_sensitive else re.IGNORECASE
-                pattern = re.compile(search_text, flags)
-                for match in pattern.finditer(line_text):
-                    matches.append((match.start(), match.group()))
-            except re.error:
-                pass
+            if pattern is None:
+                try:
+                    flags = 0 if case_sensitive else re.IGNORECASE
+                    pattern = re.compile(search_text, flags)
+                except re.error:
+                    return matches
+            
+            search = pattern.search
+            line_len = len(line_text)
+            pos = 0
+            while pos <= line_len:
+                match = search(line_text, pos)
+                if not match:
+                    break
+                start = match.start()
+                end = match.end()
+                matches.append((start, match.group()))
+                # Step past zero-length matches.  search() clamps pos to
+                # the line length, so without the bound an empty match
+                # at the end of the line would be found forever.
+                pos = end if end > start else start + 1
         else:
-            search_str = search_text if case_sensitive else search_text.lower()
-            search_in = line_text if case_sensitive else line_text.lower()
+            if case_sensitive:
+                search_str = search_text
+                search_in = line_text
+            else:
+                search_str = search_text.lower()
+                search_in = line_lower if line_lower is not None else line_text.lower()
             
             pos = 0
             while True:
@@ -1551,7 +1857,8 @@ class DiffViewer(QWidget, TabContentBase):
                     break
                 matched_text = line_text[found_pos:found_pos + len(search_text)]
                 matches.append((found_pos, matched_text))
-                pos = found_pos + len(search_text)
+                # An empty search string matches everywhere; keep moving
+                pos = found_pos + (len(search_text) or 1)
         
         return matches
     
@@ -2,10 +2,18 @@
 # All Rights Reserved.
 # Licensed under Gnu GPL V3.
 #
-import datetime
-import difflib
+import collections
+import concurrent.futures
+import functools
+import multiprocessing
 import os
 
+# cydifflib is an optional, much faster C port of difflib.
+try:
+    from cydifflib import SequenceMatcher
+except ImportError:
+    from difflib import SequenceMatcher
+
 import diff_desc
 import dumpir
 
@@ -13,80 +21,132 @@ def create_difflib(afr, base, modi):
     base_l = afr.read(base)
     modi_l = afr.read(modi)
 
-    return (difflib.SequenceMatcher(None, base_l, modi_l),
+    # Make equal lines one shared string.  Most lines of the two
+    # files are equal, and the matcher's dictionary lookups of one
+    # file's lines among the other's then succeed on identity,
+    # without comparing the text.  Repeated lines also take memory
+    # only once.
+    pool   = { }
+    base_l = [ pool.setdefault(l, l) for l in base_l ]
+    modi_l = [ pool.setdefault(l, l) for l in modi_l ]
+
+    return (SequenceMatcher(None, base_l, modi_l),
             base_l,
             modi_l)
 
 
-def decode_opinfo(label, opc, base_l, b_beg, b_end, modi_l, m_beg, m_end):
-    assert(opc in ('replace', 'delete', 'insert', 'equal'))
-    print("%10s: %8s  beg: [%d, %d)  mod: [%d, %d)" %
-          (label, opc, b_beg, b_end, m_beg, m_end))
-
-    if opc == "replace":
-        # Nothing can be asserted here.
-        print("replace:")
-        for l in base_l:
-            print("  %s" % (l))
-        for l in modi_l:
-            print("  %s" % (l))
-    elif opc == "delete":
-        assert((m_end - m_beg) == 0) # No lines in modified file.
-    elif opc == "insert":
-            assert((b_end - b_beg) == 0) # No lines in base file.
-    elif opc == "equal":
-        assert((b_end - b_beg) == (m_end - m_beg)) # Equal number of lines.
+NO_LINE_RUNS = ((), ())           # whole_line_runs() of most lines.
 
-    if False:
-        for l in base_l:
-            print("  base: %s" % (l))
 
-        print("")
-        for l in modi_l:
-            print("  modi: %s" % (l))
+def whole_line_runs(line):
+    # Tab and trailing whitespace runs of an entire line.  Most lines
+    # have neither; two substring tests find those without scanning.
+    if "\t" in line or line.endswith((" ", "\t")):
+        return scan_line_runs(line)
+    return NO_LINE_RUNS
 
 
-def add_equal_line_region(desc, base_l, modi_l):
-    assert(len(base_l) == len(modi_l))
+@functools.lru_cache(maxsize=8192)
+def scan_line_runs(line):
+    # Source files repeat many lines (blank lines, braces, license
+    # headers), so the scans are memoized by line text.  TextRuns are
+    # never modified once made, so Lines can share them.
+    l_desc = diff_desc.Line(line)
+    return (tuple(diff_desc.find_tab_runs(l_desc, 0, len(line))),
+            tuple(diff_desc.find_trailing_whitespace(l_desc)))
 
-    for l_idx in range(0, len(base_l)):
-        # Cannot use same descriptor for equal lines because line
-        # number will be incremented wrong.
-        b_desc = diff_desc.Line(base_l[l_idx])
-        m_desc = diff_desc.Line(modi_l[l_idx])
 
-        b_desc.runs_tabs_ += diff_desc.find_tab_runs(b_desc,
-                                                     0, len(b_desc.line_))
-        m_desc.runs_tabs_ += diff_desc.find_tab_runs(m_desc,
-                                                     0, len(m_desc.line_))
-        b_desc.runs_tws_  += diff_desc.find_trailing_whitespace(b_desc)
-        m_desc.runs_tws_  += diff_desc.find_trailing_whitespace(m_desc)
+def create_line_desc(line):
+    # Line descriptor for a line with no intraline changes.
+    (tab_runs, tws_runs) = whole_line_runs(line)
+    return diff_desc.UnchangedLine(line, tab_runs, tws_runs)
 
-        desc.cache_base(b_desc)
-        desc.cache_modi(m_desc)
-        desc.flush(0, False, None)
 
-def add_deleted_line_region(desc, base_l):
-    for l_idx in range(0, len(base_l)):
-        l_desc             = diff_desc.Line(base_l[l_idx])
-        l_desc.runs_tabs_ += diff_desc.find_tab_runs(l_desc,
-                                                     0, len(l_desc.line_))
-        l_desc.runs_tws_  += diff_desc.find_trailing_whitespace(l_desc)
+def common_affix_lengths(base, modi):
+    # Lengths of the common prefix and common suffix of two strings.
+    # The suffix never overlaps the prefix.
+    n_chars = min(len(base), len(modi))
+    prefix  = 0
+    while prefix < n_chars and base[prefix] == modi[prefix]:
+        prefix += 1
 
-        desc.cache_base(l_desc)
-        desc.cache_modi(diff_desc.NotPresentDelete())
-        desc.flush(0, False, None)
+    n_chars -= prefix
+    suffix   = 0
+    while suffix < n_chars and base[-1 - suffix] == modi[-1 - suffix]:
+        suffix += 1
+    return (prefix, suffix)
+
+
+def intraline_match(matcher, base, modi, threshold):
+    # Opcodes of two differing lines, or None if their match ratio is
+    # below threshold.
+    #
+    # Replaced lines usually share a long prefix and suffix
+    # (indentation, trailing punctuation).  Matching is O(n * m) in
+    # the line lengths, so only the differing middles are given to
+    # the matcher, and its opcodes are shifted back into line
+    # positions between 'equal' opcodes for the prefix and suffix.
+    #
+    # Each step up to the matching bounds the number of matching
+    # characters more tightly; once the bound is below threshold, the
+    # rest is not needed.
+    n_chars = len(base) + len(modi)
+    if threshold > 0:
+        # No more characters can match than the shorter line has.
+        if 2.0 * min(len(base), len(modi)) / n_chars < threshold:
+            return None
+
+    (prefix, suffix) = common_affix_lengths(base, modi)
+    b_mid_end = len(base) - suffix
+    m_mid_end = len(modi) - suffix
+    b_mid     = base[prefix:b_mid_end]
+    m_mid     = modi[prefix:m_mid_end]
+
+    if threshold > 0:
+        # Nor more than the middles have in common, counted as
+        # multisets.
+        n_bound = (prefix + suffix +
+                   sum((collections.Counter(b_mid) &
+                        collections.Counter(m_mid)).values()))
+        if 2.0 * n_bound / n_chars < threshold:
+            return None
+
+    matcher.set_seqs(b_mid, m_mid)
+    n_match = prefix + suffix
+    for (_, _, size) in matcher.get_matching_blocks():
+        n_match += size
+    if 2.0 * n_match / n_chars < threshold:
+        return None
+
+    opcodes = [ ]
+    if prefix > 0:
+        opcodes.append(("equal", 0, prefix, 0, prefix))
+    for (opc, b_beg, b_end, m_beg, m_end) in matcher.get_opcodes():
+        opcodes.append((opc,
+                        b_beg + prefix, b_end + prefix,
+                        m_beg + prefix, m_end + prefix))
+    if suffix > 0:
+        opcodes.append(("equal", b_mid_end, len(base), m_mid_end, len(modi)))
+
+    return opcodes
+
+
+def add_equal_line_region(desc, base_l, modi_l):
+    assert(len(base_l) == len(modi_l))
+
+    # Cannot use same descriptor for equal lines because line
+    # number will be incremented wrong.
+    desc.add_line_pairs([create_line_desc(l) for l in base_l],
+                        [create_line_desc(l) for l in modi_l])
+
+def add_deleted_line_region(desc, base_l):
+    desc.add_line_pairs([create_line_desc(l) for l in base_l],
+                        [diff_desc.NotPresentDelete() for l in base_l])
 
 
 def add_inserted_line_region(desc, modi_l):
-    for l_idx in range(0, len(modi_l)):
-        l_desc = diff_desc.Line(modi_l[l_idx])
-        l_desc.runs_tabs_ += diff_desc.find_tab_runs(l_desc,
-                                                     0, len(l_desc.line_))
-        l_desc.runs_tws_  += diff_desc.find_trailing_whitespace(l_desc)
-        desc.cache_base(diff_desc.NotPresentAdd())
-        desc.cache_modi(l_desc)
-        desc.flush(0, False, None)
+    desc.add_line_pairs([diff_desc.NotPresentAdd() for l in modi_l],
+                        [create_line_desc(l) for l in modi_l])
 
 
 def add_replaced_line_region(desc, base_l, modi_l, intraline_threshold):
@@ -101,102 +161,83 @@ def add_replaced_line_region(desc, base_l, modi_l, intraline_threshold):
     #   Whole line deletions if  len(base_l)  > len(modi_l).
     #   Whole line insertions if  len(base_l) < len(modi_l).
 
+    # One matcher, reset for each pair of lines.  Autojunk treats
+    # characters common in a line of 200+ characters (such as spaces)
+    # as junk, which hides intraline matches in long lines.
+    matcher = SequenceMatcher(None, autojunk=False)
+
+    # Bound once; called for every changed line.
+    add_line_pair = desc.add_line_pair
+
     for k in range(0, l_changed):
+        if base_l[k] == modi_l[k]:
+            # Identical lines inside a change: their only opcode would
+            # be a whole line 'equal', so skip the SequenceMatcher.
+            # Separate descriptors; each gets its own line number.
+            add_line_pair(create_line_desc(base_l[k]),
+                          create_line_desc(modi_l[k]))
+            continue
+
         l_base  = diff_desc.Line(base_l[k])
         l_modi  = diff_desc.Line(modi_l[k])
-        matcher = difflib.SequenceMatcher(None, base_l[k], modi_l[k])
-        match_ratio = matcher.ratio()
-        if match_ratio < intraline_threshold:
+
+        # The opcodes partition each line, so the tab and trailing
+        # whitespace runs are those of the whole line, whether or
+        # not intraline changes are shown.
+        (tab_runs, tws_runs) = whole_line_runs(base_l[k])
+        l_base.runs_tabs_.extend(tab_runs)
+        l_base.runs_tws_.extend(tws_runs)
+        (tab_runs, tws_runs) = whole_line_runs(modi_l[k])
+        l_modi.runs_tabs_.extend(tab_runs)
+        l_modi.runs_tws_.extend(tws_runs)
+
+        opcodes = intraline_match(matcher, base_l[k], modi_l[k],
+                                  intraline_threshold)
+        if opcodes is None:
             # Don't end up with crazy 'technicolor vomit' diffs when
             # the threshold to display intraline diffs is not met.
             # Instead, the lines are in a change block, with a
-            # particular background.  Set them to normal text, and let
-            # the background color do the work.
-            l_base.runs_tabs_ += diff_desc.find_tab_runs(l_base, 0,
-                                                         len(l_base.line_))
-            l_base.runs_tws_  += diff_desc.find_trailing_whitespace(l_base)
-
-            l_modi.runs_tabs_ += diff_desc.find_tab_runs(l_modi, 0,
-                                                         len(l_modi.line_))
-            l_modi.runs_tws_  += diff_desc.find_trailing_whitespace(l_modi)
+            # particular background.  Leave them as normal text, and
+            # let the background color do the work.
+            pass
         else:
-            for opinfo in matcher.get_opcodes():
-                opc   = opinfo[0]  # inv: ('replace', 'delete', 'insert', 'equal').
-                b_beg = opinfo[1]  # base begin index.
-                b_end = opinfo[2]  # base end index.
-                m_beg = opinfo[3]  # modi begin index.
-                m_end = opinfo[4]  # modi end index.
-
+            # opc inv: ('replace', 'delete', 'insert', 'equal').
+            # [b_beg, b_end): base indices, [m_beg, m_end): modi indices.
+            for (opc, b_beg, b_end, m_beg, m_end) in opcodes:
                 if opc == "replace":
                     # Intraline change.
-                    l_base.runs_intraline_ += [
-                        diff_desc.TextRunIntraline(b_beg,
-                                                   b_end - b_beg)
-                    ]
-                    l_base.runs_tabs_ += diff_desc.find_tab_runs(l_base, b_beg,
-                                                                 b_end - b_beg)
-                    l_base.runs_tws_  += diff_desc.find_trailing_whitespace(l_base)
-
-                    l_modi.runs_intraline_ += [
-                        diff_desc.TextRunIntraline(m_beg,
-                                                   m_end - m_beg)
-                    ]
-                    l_modi.runs_tabs_ += diff_desc.find_tab_runs(l_modi, m_beg,
-                                                                 m_end - m_beg)
-                    l_modi.runs_tws_  += diff_desc.find_trailing_whitespace(l_modi)
+                    l_base.runs_intraline_.append(
+                        diff_desc.TextRunIntraline(b_beg, b_end - b_beg))
+                    l_modi.runs_intraline_.append(
+                        diff_desc.TextRunIntraline(m_beg, m_end - m_beg))
                 elif opc == "delete":
                     assert((m_end - m_beg) == 0) # Characters deleted.
-                    r_len = b_end - b_beg
-                    l_base.runs_deleted_ += [
-                        diff_desc.TextRunDeleted(b_beg, r_len)
-                    ]
-                    l_base.runs_tabs_ += diff_desc.find_tab_runs(l_base,
-                                                                 b_beg, r_len)
-                    l_base.runs_tws_  += diff_desc.find_trailing_whitespace(l_base)
+                    l_base.runs_deleted_.append(
+                        diff_desc.TextRunDeleted(b_beg, b_end - b_beg))
                 elif opc == "insert":
                     assert((b_end - b_beg) == 0) # Characters added.
-                    l_modi.runs_added_ += [
-                        diff_desc.TextRunAdded(m_beg, m_end - m_beg)
-                    ]
-                    l_modi.runs_tabs_ += diff_desc.find_tab_runs(l_modi, m_beg,
-                                                                 m_end - m_beg)
-                    l_modi.runs_tws_  += diff_desc.find_trailing_whitespace(l_modi)
-                elif opc == "equal":
+                    l_modi.runs_added_.append(
+                        diff_desc.TextRunAdded(m_beg, m_end - m_beg))
+                else:
+                    assert(opc == "equal")
                     assert((b_end - b_beg) == (m_end - m_beg)) # Equal run
-                    l_base.runs_tabs_ += diff_desc.find_tab_runs(l_base, b_beg,
-                                                                 b_end - b_beg)
-                    l_base.runs_tws_  += diff_desc.find_trailing_whitespace(l_base)
 
-                    l_modi.runs_tabs_ += diff_desc.find_tab_runs(l_modi, m_beg,
-                                                                 m_end - m_beg)
-                    l_modi.runs_tws_  += diff_desc.find_trailing_whitespace(l_modi)
-
-        desc.cache_base(l_base)
-        desc.cache_modi(l_modi)
-        desc.flush(0, False, None)
+        add_line_pair(l_base, l_modi)
 
     if len_base < len_modi:
         # These are all line insertions in the modified file.
         assert(l_changed <= len_modi)
-        for k in range(l_changed, len_modi):
-            l_modi             = diff_desc.Line(modi_l[k])
-            l_modi.runs_tabs_ += diff_desc.find_tab_runs(l_modi,
-                                                         0, len(modi_l[k]))
-            l_modi.runs_tws_  += diff_desc.find_trailing_whitespace(l_modi)
-            desc.cache_base(diff_desc.NotPresentAdd())
-            desc.cache_modi(l_modi)
-            desc.flush(0, False, None)
+        desc.add_line_pairs([diff_desc.NotPresentAdd()
+                             for k in range(l_changed, len_modi)],
+                            [create_line_desc(modi_l[k])
+                             for k in range(l_changed, len_modi)])
     elif len_base > len_modi:
         # These are all line deletions from the modified file.
         assert(l_changed <= len_base)
-        for k in range(l_changed, len_base):
-            l_base = diff_desc.Line(base_l[k])
-            l_base.runs_tabs_ += diff_desc.find_tab_runs(l_base,
-                                                         0, len(base_l[k]))
-            l_base.runs_tws_  += diff_desc.find_trailing_whitespace(l_base)
-            desc.cache_base(l_base)
-            desc.cache_modi(diff_desc.NotPresentDelete())
-            desc.flush(0, False, None)
+        desc.add_line_pairs([create_line_desc(base_l[k])
+                             for k in range(l_changed, len_base)],
+                            [diff_desc.NotPresentDelete()
+                             for k in range(l_changed, len_base)])
     else:
         pass                    # NOP; no residual lines.
 
@@ -204,22 +245,14 @@ def add_replaced_line_region(desc, base_l, modi_l, intraline_threshold):
 
 def create_diff_descriptor(afr, verbose, intraline_percent,
                            dump_ir, base, modi):
-    if False:
-        beg = datetime.datetime.now()
-    desc  = diff_desc.DiffDesc(verbose, intraline_percent)
-    marks = ""
+    desc = diff_desc.DiffDesc(verbose, intraline_percent)
 
-    # Turn diffs create_difflib() generator into useful structure.
     (matcher, base_l, modi_l) = create_difflib(afr, base, modi)
 
     # Examines the file as a whole.
-    for opinfo in matcher.get_opcodes():
-        opc   = opinfo[0]  # inv: ('replace', 'delete', 'insert', 'equal').
-        b_beg = opinfo[1]  # base begin index.
-        b_end = opinfo[2]  # base end index.
-        m_beg = opinfo[3]  # modi begin index.
-        m_end = opinfo[4]  # modi end index.
-
+    # opc inv: ('replace', 'delete', 'insert', 'equal').
+    # [b_beg, b_end): base indices, [m_beg, m_end): modi indices.
+    for (opc, b_beg, b_end, m_beg, m_end) in matcher.get_opcodes():
         assert(opc in ('replace', 'delete', 'insert', 'equal'))
         desc.add_base_region(opc, b_beg, b_end - b_beg)
         desc.add_modi_region(opc, m_beg, m_end - m_beg)
@@ -240,11 +273,48 @@ def create_diff_descriptor(afr, verbose, intraline_percent,
                                      modi_l[m_beg:m_end],
                                      intraline_percent)
 
-    if False:
-        end = datetime.datetime.now()
-        print("create_diff_descriptor: %s: %s" % (end - beg, base))
-
     if dump_ir is not None:
         dumpir.dump(dump_ir, base, modi, desc)
 
     return desc
+
+
+def create_diff_descriptors(afr, verbose, intraline_percent,
+                            dump_ir, pairs):
+    # Generates (index, descriptor) as each (base, modi) pathname pair
+    # in 'pairs' is diffed, in the order the diffs finish.
+    #
+    # Each file is diffed independently, and the diff holds the GIL,
+    # so the files are diffed in worker processes.  A file whose
+    # descriptor could not be made in a worker gets None; the caller
+    # then diffs it with create_diff_descriptor(), which reports the
+    # failure as it would have without the workers.  Nothing is
+    # generated if workers are not worth using, or not safe to use.
+    #
+    # Closing the generator early cancels the diffs not yet started.
+    if len(pairs) < 2 or not afr.concurrent_reads_ok():
+        return
+
+    # Workers are spawned, not forked: a fork would copy the running
+    # GUI process, Qt threads and all.
+    context = multiprocessing.get_context("spawn")
+    n_procs = min(len(pairs), os.cpu_count() or 1)
+    pool    = concurrent.futures.ProcessPoolExecutor(n_procs, context)
+    try:
+        try:
+            futures = { pool.submit(create_diff_descriptor, afr, verbose,
+                                    intraline_percent, dump_ir,
+                                    base, modi) : index
+                        for (index, (base, modi)) in enumerate(pairs) }
+        except Exception:
+            # Worker processes could not be started.
+            return
+
+        for f in concurrent.futures.as_completed(futures):
+            try:
+                desc = f.result()
+            except Exception:
+                desc = None
+            yield (futures[f], desc)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
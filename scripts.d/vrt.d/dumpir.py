@@ -6,66 +6,80 @@ import os
 
 import diff_desc
 
-def dump_runs(fp, label : str, runs : diff_desc.TextRun, line_len : int):
+# Run consistency errors, as bits, and their printed names.
+ERR_LEN   = 1                   # Zero length run.
+ERR_START = 2                   # Run doesn't start where previous ended.
+ERR_NAMES = {
+    ERR_LEN             : "{'len'}",
+    ERR_START           : "{'start'}",
+    ERR_LEN | ERR_START : "{'len', 'start'}",
+}
+
+def dump_runs(out, label : str, runs : diff_desc.TextRun, line_len : int):
     total_len  = 0
     last_start = 0
     last_len   = 0
     run        = [ ]
 
     for r in runs:
-        errors = set()
+        errors = 0
         start_ = r.start_
         len_   = r.len_
 
         total_len += len_
 
         if len_ == 0:
-            errors.add("len")
+            errors |= ERR_LEN
 
         if line_len >= 0 and start_ != last_start + last_len:
-            errors.add("start")
+            errors |= ERR_START
 
         last_start = start_
         last_len   = len_
 
-        if len(errors) == 0:
-            run.append("%s" % (r))
+        if errors == 0:
+            run.append(str(r))
         else:
-            run.append("%s <err>: %s" % (r, errors))
+            run.append(f"{r} <err>: {ERR_NAMES[errors]}")
 
     if total_len == line_len or line_len < 0:
-        fp.write("  %s: %s\n" % (label, "  ".join(run)))
+        out.append(f"  {label}: {'  '.join(run)}\n")
     else:
-        fp.write("  %s: %s  <err>: total len\n" % (label, "  ".join(run)))
+        out.append(f"  {label}: {'  '.join(run)}  <err>: total len\n")
 
 
 def dumplines(pathname, info):
+    # The dump is built in memory and written in one call; a large
+    # diff has several output lines per source line.
+    out   = [ ]
+    write = out.append
+
+    write("Regions:\n")
+    i = 0
+    for rgn in info.regions_:
+        rgn.ir_number_ = i
+        write(f"  {i:3}. {rgn}\n")
+        i += 1
+
+    write("\n\nLines:\n")
+    for l in info.lines_:
+        line_len = len(l.line_)
+
+        write(f"{l.line_num_:<5}  <{l.line_}>\n  len: {line_len}\n")
+        if l.region_ is not None:
+            write(f"  rgn: {l.region_.ir_number_}  {l.region_}\n")
+        else:
+            write("  rgn: none\n")
+
+        dump_runs(out, "add  ", l.runs_added_, -1)
+        dump_runs(out, "del  ", l.runs_deleted_, -1)
+        dump_runs(out, "intra", l.runs_intraline_, -1)
+        dump_runs(out, "tws  ", l.runs_tws_, -1)
+        dump_runs(out, "tab  ", l.runs_tabs_, -1)
+        write("\n")
+
     with open(pathname, "w") as fp:
-        fp.write("Regions:\n")
-        i = 0
-        for rgn in info.regions_:
-            rgn.ir_number_ = i
-            fp.write("  %3d. %s\n" % (i, rgn))
-            i += 1
-
-        fp.write("\n\nLines:\n")
-        for l in info.lines_:
-            line_len = len(l.line_)
-
-            fp.write("%-5d  <%s>\n" % (l.line_num_, l.line_))
-            fp.write("  len: %d\n" % (line_len))
-            if l.region_ is not None:
-                fp.write("  rgn: %d  %s\n" % (l.region_.ir_number_,
-                                              str(l.region_)))
-            else:
-                fp.write("  rgn: none\n")
-
-            dump_runs(fp, "add  ", l.runs_added_, -1)
-            dump_runs(fp, "del  ", l.runs_deleted_, -1)
-            dump_runs(fp, "intra", l.runs_intraline_, -1)
-            dump_runs(fp, "tws  ", l.runs_tws_, -1)
-            dump_runs(fp, "tab  ", l.runs_tabs_, -1)
-            fp.write("\n")
+        fp.write("".join(out))
 
 
 def dump(rootdir, base, modi, desc):
@@ -3,16 +3,18 @@
 # Licensed under Gnu GPL V3.
 #
 
-from PyQt6.QtWidgets import QTextEdit, QApplication
+from PyQt6.QtWidgets import QPlainTextEdit, QApplication
 from PyQt6.QtGui import QFont, QTextCursor, QFontMetrics, QTextCharFormat, QColor
-from PyQt6.QtCore import Qt, pyqtSignal, QTimer
+from PyQt6.QtCore import Qt, pyqtSignal, QTimer, QSocketNotifier
 from tab_content_base import TabContentBase
 import pyte
+import codecs
+import itertools
+import operator
 import struct
 import fcntl
 import termios
 import os
-import select
 import signal
 
 
@@ -49,26 +51,46 @@ class TerminalTheme:
         return themes.get(theme_name, TerminalTheme.CLASSIC_GREEN)
 
 
+PYTE_COLOR_RGB = {
+    "black": (0, 0, 0),
+    "red": (205, 49, 49),
+    "green": (13, 188, 121),
+    "brown": (229, 229, 16),
+    "blue": (36, 114, 200),
+    "magenta": (188, 63, 188),
+    "cyan": (17, 168, 205),
+    "white": (229, 229, 229),
+    "brightblack": (102, 102, 102),
+    "brightred": (241, 76, 76),
+    "brightgreen": (35, 209, 139),
+    "brightyellow": (245, 245, 67),
+    "brightblue": (59, 142, 234),
+    "brightmagenta": (214, 112, 214),
+    "brightcyan": (41, 184, 219),
+    "brightwhite": (255, 255, 255),
+}
+
+PYTE_COLOR_NAMES = ["black", "red", "green", "brown", "blue", "magenta", "cyan", "white",
+                    "brightblack", "brightred", "brightgreen", "brightyellow",
+                    "brightblue", "brightmagenta", "brightcyan", "brightwhite"]
+
+# QColor (or None) of each pyte color seen so far.  A screen uses only
+# a handful of colors, but each run of every redraw looks one up.
+_pyte_qcolors = {}
+
+
 def map_pyte_color_to_qcolor(color_name, is_background):
-    color_map = {
-        "black": (0, 0, 0),
-        "red": (205, 49, 49),
-        "green": (13, 188, 121),
-        "brown": (229, 229, 16),
-        "blue": (36, 114, 200),
-        "magenta": (188, 63, 188),
-        "cyan": (17, 168, 205),
-        "white": (229, 229, 229),
-        "brightblack": (102, 102, 102),
-        "brightred": (241, 76, 76),
-        "brightgreen": (35, 209, 139),
-        "brightyellow": (245, 245, 67),
-        "brightblue": (59, 142, 234),
-        "brightmagenta": (214, 112, 214),
-        "brightcyan": (41, 184, 219),
-        "brightwhite": (255, 255, 255),
-    }
+    # The result doesn't depend on is_background, so neither does the
+    # cache.  Callers only copy the returned QColor into formats.
+    try:
+        return _pyte_qcolors[color_name]
+    except KeyError:
+        color = make_pyte_qcolor(color_name)
+        _pyte_qcolors[color_name] = color
+        return color
 
+
+def make_pyte_qcolor(color_name):
     if isinstance(color_name, str):
         if color_name == "default":
             return None
@@ -80,17 +102,14 @@ def map_pyte_color_to_qcolor(color_name, is_background):
                 return QColor(r, g, b)
             except ValueError:
                 pass
-        rgb = color_map.get(color_name)
+        rgb = PYTE_COLOR_RGB.get(color_name)
         if rgb:
             return QColor(*rgb)
         return None
     elif isinstance(color_name, int):
         if color_name < 16:
-            names = ["black", "red", "green", "brown", "blue", "magenta", "cyan", "white",
-                     "brightblack", "brightred", "brightgreen", "brightyellow",
-                     "brightblue", "brightmagenta", "brightcyan", "brightwhite"]
-            if color_name < len(names):
-                rgb = color_map.get(names[color_name])
+            if color_name < len(PYTE_COLOR_NAMES):
+                rgb = PYTE_COLOR_RGB.get(PYTE_COLOR_NAMES[color_name])
                 if rgb:
                     return QColor(*rgb)
         elif color_name < 232:
@@ -106,11 +125,18 @@ def map_pyte_color_to_qcolor(color_name, is_background):
     return None
 
 
-class TerminalWidget(QTextEdit, TabContentBase):
+# The pyte.Char attributes shown by a QTextCharFormat, in the order
+# TerminalWidget.make_char_format() takes them.
+_char_format_key = operator.attrgetter("fg", "bg", "bold", "italics",
+                                       "underscore", "reverse")
+
+
+class TerminalWidget(QPlainTextEdit, TabContentBase):
     process_exited = pyqtSignal(int)
 
     ESCAPE_PREFIX_TIMEOUT = 2000  # milliseconds
     ESCAPE_PREFIX_BORDER_COLOR = "#4499DD"  # Medium bright blue
+    REDRAW_INTERVAL = 16  # milliseconds; shortest time between redraws
 
     def __init__(self, parent, theme, pathname):
         super().__init__(parent)
@@ -123,47 +149,67 @@ class TerminalWidget(QTextEdit, TabContentBase):
         self.screen = CompatScreen(80, 24)
         self.stream = pyte.Stream(self.screen)
         self.master_fd = None
+        self.notifier = None
+        # Holds a multibyte character split across two reads.
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
         self.updating_display = False
+        self.line_cache = []  # Screen line shown in each block; see update_display()
+        self.redraw_pending = False
+        self.redraw_timer = QTimer(self)
+        self.redraw_timer.setSingleShot(True)
+        self.redraw_timer.setInterval(self.REDRAW_INTERVAL)
+        self.redraw_timer.timeout.connect(self._on_redraw_timeout)
         self.process_pid = None
+        self.pidfd = None
+        self.pidfd_notifier = None
         self.timer = None
         self.escape_prefix_active = False
         self.escape_prefix_timer = None
         self.setup_terminal()
+        self.document().contentsChanged.connect(self._on_contents_changed)
 
     def setup_terminal(self):
         self.setReadOnly(False)
-        font = QFont("Courier New", self.current_font_size)
-        self.setFont(font)
+        self.set_font_size(self.current_font_size)
         theme_name, bg_color, fg_color = self.theme
         self.setStyleSheet(f"""
-            QTextEdit {{
+            QPlainTextEdit {{
                 background-color: {bg_color};
                 color: {fg_color};
             }}
         """)
         self.setCursorWidth(10)
+        # Colors of cells with pyte's "default" colors, for update_display()
+        self.default_bg = QColor(bg_color)
+        self.default_fg = QColor(fg_color)
+        # QTextCharFormat of each pyte attribute combination seen; see
+        # insert_line().  The formats depend on the default colors.
+        self.format_cache = {}
 
     def increase_font_size(self):
         """Increase terminal font size"""
-        self.current_font_size = min(self.current_font_size + 1, 24)
-        font = QFont("Courier New", self.current_font_size)
-        self.setFont(font)
+        self.set_font_size(min(self.current_font_size + 1, 24))
         self.update_terminal_size()
 
     def decrease_font_size(self):
         """Decrease terminal font size"""
-        self.current_font_size = max(self.current_font_size - 1, 6)
-        font = QFont("Courier New", self.current_font_size)
-        self.setFont(font)
+        self.set_font_size(max(self.current_font_size - 1, 6))
         self.update_terminal_size()
 
     def reset_font_size(self):
         """Reset terminal font size to default (10pt)"""
-        self.current_font_size = 10
-        font = QFont("Courier New", self.current_font_size)
-        self.setFont(font)
+        self.set_font_size(10)
         self.update_terminal_size()
 
+    def set_font_size(self, size):
+        """Use a 'size' point terminal font, and record its cell size"""
+        self.current_font_size = size
+        self.setFont(QFont("Courier New", size))
+        # Cell size for calculate_terminal_size(), which runs on every resize
+        metrics = QFontMetrics(self.font())
+        self.char_width = metrics.horizontalAdvance('M')
+        self.char_height = metrics.height()
+
     def set_escape_prefix_active(self, active):
         """Set the escape prefix state and update border visual feedback"""
         self.escape_prefix_active = active
@@ -172,7 +218,7 @@ class TerminalWidget(QTextEdit, TabContentBase):
             # Show colored border
             theme_name, bg_color, fg_color = self.theme
             self.setStyleSheet(f"""
-                QTextEdit {{
+                QPlainTextEdit {{
                     background-color: {bg_color};
                     color: {fg_color};
                     border: 3px solid {self.ESCAPE_PREFIX_BORDER_COLOR};
@@ -188,7 +234,7 @@ class TerminalWidget(QTextEdit, TabContentBase):
             # Restore normal border
             theme_name, bg_color, fg_color = self.theme
             self.setStyleSheet(f"""
-                QTextEdit {{
+                QPlainTextEdit {{
                     background-color: {bg_color};
                     color: {fg_color};
                 }}
@@ -197,6 +243,11 @@ class TerminalWidget(QTextEdit, TabContentBase):
             if self.escape_prefix_timer is not None:
                 self.escape_prefix_timer.stop()
 
+    def _on_contents_changed(self):
+        """Forget what was displayed if the text was edited other than by update_display()"""
+        if not self.updating_display:
+            self.line_cache = []
+
     def is_escape_prefix_active(self):
         """Return whether the escape prefix is currently active"""
         return self.escape_prefix_active
@@ -255,6 +306,12 @@ class TerminalWidget(QTextEdit, TabContentBase):
                 pass
             except OSError:
                 pass
+        if self.notifier is not None:
+            self.notifier.setEnabled(False)
+        if self.pidfd is not None:
+            self.pidfd_notifier.setEnabled(False)
+            os.close(self.pidfd)
+            self.pidfd = None
         if self.master_fd is not None:
             try:
                 os.close(self.master_fd)
@@ -264,19 +321,18 @@ class TerminalWidget(QTextEdit, TabContentBase):
 
     def set_master_fd(self, fd):
         self.master_fd = fd
+        # Let Qt wake us when the pty has output, rather than polling.
+        self.notifier = QSocketNotifier(fd, QSocketNotifier.Type.Read, self)
+        self.notifier.activated.connect(self._on_readable)
         self.update_terminal_size()
         rows, cols = self.calculate_terminal_size()
 
     def calculate_terminal_size(self):
-        metrics = QFontMetrics(self.font())
-        char_width = metrics.horizontalAdvance('M')
-        char_height = metrics.height()
-
         width = self.viewport().width()
         height = self.viewport().height()
 
-        cols = max(1, width // char_width)
-        rows = max(1, height // char_height)
+        cols = max(1, width // self.char_width)
+        rows = max(1, height // self.char_height)
 
         return rows, cols
 
@@ -359,110 +415,171 @@ class TerminalWidget(QTextEdit, TabContentBase):
         self.insertPlainText(text)
 
     def process_output(self, data):
+        # Output that arrives in a burst is drawn at most once per
+        # REDRAW_INTERVAL, leaving the event loop free to handle input
+        # between reads.  Output after a quiet spell is drawn at once.
         self.stream.feed(data)
-        self.update_display()
+        if self.redraw_timer.isActive():
+            self.redraw_pending = True
+        else:
+            self.update_display()
+            self.redraw_timer.start()
+
+    def _on_redraw_timeout(self):
+        if self.redraw_pending:
+            self.redraw_pending = False
+            self.update_display()
+            self.redraw_timer.start()
 
     def update_display(self):
+        """Show the pyte screen, replacing only the lines that changed since last shown"""
         self.updating_display = True
 
         cursor = self.textCursor()
         cursor.beginEditBlock()
-        cursor.select(QTextCursor.SelectionType.Document)
-        cursor.removeSelectedText()
 
-        theme_name, bg_color_str, fg_color_str = self.theme
-        default_bg = QColor(bg_color_str)
-        default_fg = QColor(fg_color_str)
-
-        for y in range(self.screen.lines):
-            if y > 0:
-                cursor.insertText("\n")
-
-            x = 0
-            while x < self.screen.columns:
-                char = self.screen.buffer[y][x]
-
-                fg_color = map_pyte_color_to_qcolor(char.fg, False)
-                bg_color = map_pyte_color_to_qcolor(char.bg, True)
-
-                if fg_color is None:
-                    fg_color = default_fg
-                if bg_color is None:
-                    bg_color = default_bg
-
-                fmt = QTextCharFormat()
-                fmt.setForeground(fg_color)
-                fmt.setBackground(bg_color)
-
-                if char.bold:
-                    fmt.setFontWeight(700)
-                if char.italics:
-                    fmt.setFontItalic(True)
-                if char.underscore:
-                    fmt.setFontUnderline(True)
-                if char.reverse:
-                    fmt.setForeground(bg_color)
-                    fmt.setBackground(fg_color)
-
-                run_start = x
-                run_text = char.data
-
-                x += 1
-                while x < self.screen.columns:
-                    next_char = self.screen.buffer[y][x]
-                    if (next_char.fg != char.fg or
-                        next_char.bg != char.bg or
-                        next_char.bold != char.bold or
-                        next_char.italics != char.italics or
-                        next_char.underscore != char.underscore or
-                        next_char.reverse != char.reverse):
-                        break
-                    run_text += next_char.data
-                    x += 1
-
-                cursor.insertText(run_text, fmt)
+        n_lines = self.screen.lines
+        if len(self.line_cache) != n_lines:
+            # First display, resize, or outside edit: start over with
+            # one empty block per screen line.
+            cursor.select(QTextCursor.SelectionType.Document)
+            cursor.removeSelectedText()
+            cursor.insertText("\n" * (n_lines - 1))
+            self.line_cache = [None] * n_lines
+            lines = range(n_lines)
+        else:
+            # pyte records the lines it has changed since last shown.
+            lines = sorted(y for y in self.screen.dirty if y < n_lines)
+        self.screen.dirty.clear()
+
+        document = self.document()
+        columns = range(self.screen.columns)
+        for y in lines:
+            row = self.screen.buffer[y]
+            line = tuple([row[x] for x in columns])
+            if line == self.line_cache[y]:
+                continue
+            self.line_cache[y] = line
+
+            block = document.findBlockByNumber(y)
+            cursor.setPosition(block.position())
+            cursor.movePosition(QTextCursor.MoveOperation.EndOfBlock,
+                                QTextCursor.MoveMode.KeepAnchor)
+            cursor.removeSelectedText()
+            self.insert_line(cursor, line)
 
         cursor.endEditBlock()
         self.update_cursor_position()
         self.updating_display = False
 
+    def insert_line(self, cursor, line):
+        """Insert the pyte characters of one screen line, in runs of like format"""
+        format_cache = self.format_cache
+
+        for key, run in itertools.groupby(line, _char_format_key):
+            fmt = format_cache.get(key)
+            if fmt is None:
+                if len(format_cache) >= 4096:
+                    format_cache.clear()
+                fmt = self.make_char_format(*key)
+                format_cache[key] = fmt
+
+            cursor.insertText("".join([char.data for char in run]), fmt)
+
+    def make_char_format(self, fg, bg, bold, italics, underscore, reverse):
+        """Return the QTextCharFormat showing the given pyte character attributes"""
+        fg_color = map_pyte_color_to_qcolor(fg, False)
+        bg_color = map_pyte_color_to_qcolor(bg, True)
+
+        if fg_color is None:
+            fg_color = self.default_fg
+        if bg_color is None:
+            bg_color = self.default_bg
+
+        fmt = QTextCharFormat()
+        fmt.setForeground(fg_color)
+        fmt.setBackground(bg_color)
+
+        if bold:
+            fmt.setFontWeight(700)
+        if italics:
+            fmt.setFontItalic(True)
+        if underscore:
+            fmt.setFontUnderline(True)
+        if reverse:
+            fmt.setForeground(bg_color)
+            fmt.setBackground(fg_color)
+        return fmt
+
     def update_cursor_position(self):
         cursor_y = self.screen.cursor.y
         cursor_x = self.screen.cursor.x
 
-        cursor = self.textCursor()
-        cursor.movePosition(QTextCursor.MoveOperation.Start)
-
-        for _ in range(cursor_y):
-            cursor.movePosition(QTextCursor.MoveOperation.Down)
-
-        cursor.movePosition(QTextCursor.MoveOperation.StartOfLine)
-        for _ in range(cursor_x):
-            cursor.movePosition(QTextCursor.MoveOperation.Right)
+        # Each screen line is one block; see update_display().
+        block = self.document().findBlockByNumber(cursor_y)
+        if not block.isValid():
+            return
 
+        cursor = self.textCursor()
+        cursor.setPosition(block.position() + min(cursor_x, block.length() - 1))
         self.setTextCursor(cursor)
 
     def read_output(self):
+        # Only called when the notifier reports the pty readable, so
+        # this read does not block.  Read everything queued so a burst
+        # of output is fed to pyte and drawn once.
         if self.master_fd is None:
             return
 
         try:
-            while True:
-                ready, _, _ = select.select([self.master_fd], [], [], 0)
-                if not ready:
-                    break
-                data = os.read(self.master_fd, 4096)
-                if not data:
-                    break
-                text = data.decode('utf-8', errors='replace')
-                self.process_output(text)
+            avail = struct.unpack('i', fcntl.ioctl(self.master_fd, termios.FIONREAD,
+                                                   struct.pack('i', 0)))[0]
+            data = os.read(self.master_fd, max(avail, 4096))
         except OSError:
-            pass
+            data = b""          # EIO: the child closed the pty.
+
+        if data:
+            self.process_output(self.decoder.decode(data))
+        else:
+            # A closed pty stays readable; stop the notifier from
+            # firing continuously and reap the child now.
+            self.notifier.setEnabled(False)
+            tail = self.decoder.decode(b"", final=True)
+            if tail:
+                self.process_output(tail)
+            self.check_process()
+
+    def _on_readable(self, socket):
+        self.read_output()
+
+    def watch_process(self, pid):
+        """Record 'pid' as the editor process, and notice when it exits"""
+        self.process_pid = pid
+        try:
+            # Linux 5.3+: the pidfd becomes readable when the child exits.
+            self.pidfd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            self.timer = QTimer(self)
+            self.timer.timeout.connect(self.check_process)
+            self.timer.start(1000)
+            return
+        self.pidfd_notifier = QSocketNotifier(self.pidfd,
+                                              QSocketNotifier.Type.Read, self)
+        self.pidfd_notifier.activated.connect(self._on_process_event)
+
+    def _on_process_event(self, socket):
+        self.check_process()
 
+    def check_process(self):
         if self.process_pid:
             pid, status = os.waitpid(self.process_pid, os.WNOHANG)
             if pid != 0:
-                self.timer.stop()
+                if self.timer is not None:
+                    self.timer.stop()
+                if self.pidfd_notifier is not None:
+                    self.pidfd_notifier.setEnabled(False)
+                    os.close(self.pidfd)
+                    self.pidfd = None
                 exit_code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
                 self.process_output(f"\n[Process exited with code {exit_code}]\n")
                 self.process_pid = None
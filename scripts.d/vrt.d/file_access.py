@@ -9,17 +9,23 @@ class FileAccess(object):
         self.root_ = root
 
     def read(self, pathname):
-        lines = self.read_(pathname)
-
-        # Convert all line endings to a single '\n'.
-        lines = lines.replace("\r\n", "\n") # Convert Windows files to Linux.
-        lines = lines.replace("\r", "\n")   # Convert Mac files to Linux.
-        result = lines.splitlines()
+        result = self.read_lines_(pathname)
 
         # The returned list of strings will NOT have '\n' at the end.
         # Blank lines will be zero length.
         return result
 
+    def concurrent_reads_ok(self):
+        # True if read() can be called from other threads or worker
+        # processes, meaning it never needs to interact with the user.
+        return False
+
+    def read_lines_(self, pathname):
+        # splitlines() ends lines at '\r\n' (Windows), '\r' (Mac) and
+        # '\n' (Linux) alike, so no line ending conversion is needed.
+        # Subclasses that can read a line at a time override this.
+        return self.read_(pathname).splitlines()
+
     def read_(self, pathname):
         raise NotImplementedError("%s.read_() is not defined." %
                                   (self.__class__.__name__))
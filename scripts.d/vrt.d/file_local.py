@@ -10,6 +10,26 @@ class LocalFileAccess(file_access.FileAccess):
     def __init__(self, root):
         super().__init__(root)
 
+    def concurrent_reads_ok(self):
+        return True
+
+    def read_lines_(self, pathname):
+        full_pathname = os.path.join(self.root_, pathname)
+
+        if os.path.exists(full_pathname) and os.access(full_pathname, os.R_OK):
+            # Reading a line at a time never holds the whole file as
+            # one string beside its lines.  Splitting each line with
+            # splitlines() ends lines exactly where the base class's
+            # splitlines() of the whole file would, including at the
+            # separators other than '\n', such as '\f' and '\u2028'.
+            result = [ ]
+            with open(full_pathname, "r") as fp:
+                for line in fp:
+                    result.extend(line.splitlines())
+            return result
+        else:
+            return super().read_lines_(pathname) # read_() explains why.
+
     def read_(self, pathname):
         pathname = os.path.join(self.root_, pathname)
 
@@ -16,6 +16,11 @@ class URLFileAccess(file_access.FileAccess):
         self.root_url_          = root_url
         self.ack_insecure_cert_ = ack_insecure_cert
 
+    def concurrent_reads_ok(self):
+        # Fetching may prompt for credentials, or to accept an
+        # unverified certificate, which only the GUI thread can do.
+        return False
+
     def read_(self, pathname):
         import fetchurl
 
@@ -392,6 +392,7 @@ class HelpDialog(QDialog):
             <li><b>--display-n-lines:</b> Set number of lines visible in initial window (default: 60)</li>
             <li><b>--display-n-chars:</b> Set number of characters per pane in initial window (default: 90)</li>
             <li><b>--max-line-length:</b> Set maximum line length indicator position (default: 80)</li>
+            <li><b>--max-highlight-lines:</b> Above this many lines, highlight only line backgrounds, not changed characters; 0 means no limit (default: 20000)</li>
             <li><b>--note-file:</b> Specify file for saving notes</li>
             <li><b>--tab-label-show-stats / --no-tab-label-show-stats:</b> Show/hide file statistics in tab labels (default: show)</li>
             <li><b>--file-label-show-stats / --no-file-label-show-stats:</b> Show/hide file statistics in sidebar file buttons (default: hide)</li>
@@ -653,28 +653,30 @@ class NoteManager:
             if not note_file:
                 return False
         
+        # Build the whole note, then append it with a single write
+        if is_commit_msg:
+            # Commit message format with line range [start, end)
+            start_line, end_line = line_numbers
+            note = [f"> (commit_msg): Commit Message:[{start_line},{end_line})\n"]
+            note.extend(f">   {line_text}\n" for line_text in line_texts)
+        else:
+            # Source file format with range
+            prefix = '(base)' if side == 'base' else '(modi)'
+            clean_filename = extract_display_path(file_path)
+            
+            # Calculate range [start, end)
+            start_line = line_numbers[0]
+            end_line = line_numbers[-1] + 1
+            
+            note = [f"> {prefix}: {clean_filename}:[{start_line},{end_line})\n"]
+            note.extend(f">   {line_num}: {line_text}\n"
+                        for line_num, line_text in zip(line_numbers, line_texts))
+        
+        note.append('>\n\n\n')
+        
         try:
             with open(note_file, 'a', encoding='utf-8') as f:
-                if is_commit_msg:
-                    # Commit message format with line range [start, end)
-                    start_line, end_line = line_numbers
-                    f.write(f"> (commit_msg): Commit Message:[{start_line},{end_line})\n")
-                    for line_text in line_texts:
-                        f.write(f">   {line_text}\n")
-                else:
-                    # Source file format with range
-                    prefix = '(base)' if side == 'base' else '(modi)'
-                    clean_filename = extract_display_path(file_path)
-                    
-                    # Calculate range [start, end)
-                    start_line = line_numbers[0]
-                    end_line = line_numbers[-1] + 1
-                    
-                    f.write(f"> {prefix}: {clean_filename}:[{start_line},{end_line})\n")
-                    for line_num, line_text in zip(line_numbers, line_texts):
-                        f.write(f">   {line_num}: {line_text}\n")
-                
-                f.write('>\n\n\n')
+                f.write(''.join(note))
             
             # Switch to notes tab immediately after taking note
             self.on_notes_clicked()
@@ -959,25 +961,23 @@ class NoteManager:
             if side == 'base':
                 viewer.base_noted_lines.discard(line_num)
                 # Remove yellow highlighting from display
-                for i, num in enumerate(viewer.base_line_nums):
-                    if num == line_num:
-                        # Clear the noted line marking
-                        if hasattr(viewer.base_text, 'noted_lines'):
-                            viewer.base_text.noted_lines.discard(i)
-                        viewer.base_text.viewport().update()
-                        viewer.base_line_area.noted_lines.discard(i)
-                        viewer.base_line_area.update()
+                for i in viewer.line_num_indices('base', line_num):
+                    # Clear the noted line marking
+                    if hasattr(viewer.base_text, 'noted_lines'):
+                        viewer.base_text.noted_lines.discard(i)
+                    viewer.base_text.viewport().update()
+                    viewer.base_line_area.noted_lines.discard(i)
+                    viewer.base_line_area.update()
             else:
                 viewer.modified_noted_lines.discard(line_num)
                 # Remove yellow highlighting from display
-                for i, num in enumerate(viewer.modified_line_nums):
-                    if num == line_num:
-                        # Clear the noted line marking
-                        if hasattr(viewer.modified_text, 'noted_lines'):
-                            viewer.modified_text.noted_lines.discard(i)
-                        viewer.modified_text.viewport().update()
-                        viewer.modified_line_area.noted_lines.discard(i)
-                        viewer.modified_line_area.update()
+                for i in viewer.line_num_indices('modified', line_num):
+                    # Clear the noted line marking
+                    if hasattr(viewer.modified_text, 'noted_lines'):
+                        viewer.modified_text.noted_lines.discard(i)
+                    viewer.modified_text.viewport().update()
+                    viewer.modified_line_area.noted_lines.discard(i)
+                    viewer.modified_line_area.update()
     
     def update_button_state(self, is_open, is_active):
         """Update Review Notes button style based on state"""
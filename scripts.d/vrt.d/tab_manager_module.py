@@ -35,6 +35,36 @@ from tab_content_base import TabContentBase
 from diff_viewer import DiffViewer
 
 
+# Key sets consulted on every key press; built once rather than per event.
+
+# Modifier-only key presses ignored by multi-key sequence matching.
+_SEQUENCE_MODIFIER_KEYS = frozenset((
+    Qt.Key.Key_Shift, Qt.Key.Key_Control, Qt.Key.Key_Alt,
+    Qt.Key.Key_Meta, Qt.Key.Key_AltGr, Qt.Key.Key_CapsLock))
+
+# Modifier-only key presses that must not clear the terminal escape prefix.
+_TERMINAL_MODIFIER_KEYS = frozenset((
+    Qt.Key.Key_Shift, Qt.Key.Key_Control,
+    Qt.Key.Key_Alt, Qt.Key.Key_Meta,
+    Qt.Key.Key_Super_L, Qt.Key.Key_Super_R,
+    Qt.Key.Key_Hyper_L, Qt.Key.Key_Hyper_R,
+    Qt.Key.Key_AltGr))
+
+# Qt reports ShiftModifier for shifted symbols like $, %, etc.
+# But these symbols can't be typed without Shift, so the Shift is implicit.
+_SHIFTED_SYMBOL_KEYS = frozenset((
+    Qt.Key.Key_Exclam, Qt.Key.Key_At, Qt.Key.Key_NumberSign,
+    Qt.Key.Key_Dollar, Qt.Key.Key_Percent, Qt.Key.Key_AsciiCircum,
+    Qt.Key.Key_Ampersand, Qt.Key.Key_Asterisk, Qt.Key.Key_ParenLeft,
+    Qt.Key.Key_ParenRight, Qt.Key.Key_Underscore, Qt.Key.Key_Plus,
+    Qt.Key.Key_BraceLeft, Qt.Key.Key_BraceRight, Qt.Key.Key_Bar,
+    Qt.Key.Key_Colon, Qt.Key.Key_QuoteDbl, Qt.Key.Key_Less,
+    Qt.Key.Key_Greater, Qt.Key.Key_Question, Qt.Key.Key_AsciiTilde))
+
+_SHIFT_MODIFIER = Qt.KeyboardModifier.ShiftModifier
+_NO_MODIFIER    = Qt.KeyboardModifier.NoModifier
+
+
 class OverlayWidget(QWidget):
     """Widget that can have a dimming overlay that auto-resizes"""
 
@@ -195,6 +225,7 @@ class DiffViewerTabWidget(QMainWindow):
                  intraline_percent : float,
                  palette           : str,
                  dump_ir           : bool,
+                 verbose           : bool,
                  tab_label_stats   : bool,
                  file_label_stats  : bool,
                  editor_class,
@@ -215,6 +246,7 @@ class DiffViewerTabWidget(QMainWindow):
         self.ignore_trailing_ws = ignore_trailing_ws
         self.ignore_intraline = ignore_intraline
         self.dump_ir = dump_ir
+        self.verbose = verbose
         self.intraline_percent = intraline_percent
         self._bulk_loading = False  # Suppress highlighting during "Open All Files"
         self.editor_class = editor_class
@@ -664,16 +696,27 @@ class DiffViewerTabWidget(QMainWindow):
                 self.tab_widget.setCurrentIndex(0)
             return
 
+        # Diff the files in parallel up front, rather than one by one
+        # as each viewer is made.  Under --verbose each viewer diffs
+        # its own file, keeping each file's trace output together.
+        prefetch = []
+        if not self.verbose:
+            prefetch = [item_data for item_type, item_data in files_to_open
+                        if item_type == 'file' and hasattr(item_data, 'set_prefetched_descriptor')]
+
         # Enable bulk loading mode to suppress highlighting during load
         self._bulk_loading = True
 
-        # Create progress dialog
-        progress = QProgressDialog("Loading files...", "Cancel", 0, len(files_to_open), self)
+        # Create progress dialog; it counts files diffed, then files loaded
+        progress = QProgressDialog("Loading files...", "Cancel", 0,
+                                   len(prefetch) + len(files_to_open), self)
         progress.setWindowTitle("Opening Files")
         progress.setWindowModality(Qt.WindowModality.WindowModal)
         progress.setMinimumDuration(500)  # Only show if takes more than 500ms
 
-        current_index = 0
+        self.prefetch_diff_descriptors(prefetch, progress)
+
+        current_index = len(prefetch)
 
         # Open files that aren't already open
         for item_type, item_data in files_to_open:
@@ -701,7 +744,12 @@ class DiffViewerTabWidget(QMainWindow):
 
             current_index += 1
 
-        progress.setValue(len(files_to_open))
+        # A file left unopened by Cancel must not keep its descriptor:
+        # the file may have changed by the time it is opened.
+        for file_class in prefetch:
+            file_class.set_prefetched_descriptor(None)
+
+        progress.setValue(progress.maximum())
         progress.close()
 
         # Disable bulk loading mode
@@ -723,6 +771,40 @@ class DiffViewerTabWidget(QMainWindow):
             self.update_focus_tinting()
             self.update_status_focus_indicator()
 
+    def prefetch_diff_descriptors(self, file_classes, progress):
+        """
+        Make the diff descriptors of several files at once, in parallel.
+
+        Args:
+            file_classes: File objects about to be opened, with
+                          diff_paths() and set_prefetched_descriptor()
+                          methods.  Each is given its descriptor, which
+                          its viewer then uses instead of diffing.
+            progress: QProgressDialog advanced as each file is diffed.
+                      Cancel stops the diffing.
+        """
+        import diffmgrng as diffmgr
+
+        if not file_classes:
+            return
+
+        progress.setLabelText("Comparing files...")
+        QApplication.processEvents()
+        descs = diffmgr.create_diff_descriptors(self.afr_,
+                                                False,
+                                                self.intraline_percent,
+                                                self.dump_ir,
+                                                [fc.diff_paths() for fc in file_classes])
+        try:
+            for n_diffed, (index, desc) in enumerate(descs, 1):
+                file_classes[index].set_prefetched_descriptor(desc)
+                progress.setValue(n_diffed)
+                QApplication.processEvents()  # Keep UI responsive
+                if progress.wasCanceled():
+                    break
+        finally:
+            descs.close()  # Cancels the diffs not yet started
+
     def on_file_clicked(self, file_class):
         """Handle file button click"""
         # Check if tab already exists for this file
@@ -1384,17 +1466,9 @@ class DiffViewerTabWidget(QMainWindow):
 
         # Reset highlighting state
         viewer.highlighting_applied = False
-        viewer.highlighting_in_progress = False
-        viewer.highlighting_next_line = 0
 
         # Clear existing data
-        viewer.base_display = []
-        viewer.modified_display = []
-        viewer.base_line_nums = []
-        viewer.modified_line_nums = []
-        viewer.change_regions = []
-        viewer.base_line_objects = []
-        viewer.modified_line_objects = []
+        viewer.clear_lines()
 
         # Reload diff
         try:
@@ -1706,8 +1780,7 @@ class DiffViewerTabWidget(QMainWindow):
         modifiers = event.modifiers()
 
         # Ignore modifier-only key presses (Shift, Ctrl, Alt, Meta by themselves)
-        if key in (Qt.Key.Key_Shift, Qt.Key.Key_Control, Qt.Key.Key_Alt,
-                   Qt.Key.Key_Meta, Qt.Key.Key_AltGr, Qt.Key.Key_CapsLock):
+        if key in _SEQUENCE_MODIFIER_KEYS:
             return
 
         # Build current key press as (qt_key, modifiers)
@@ -1846,22 +1919,11 @@ class DiffViewerTabWidget(QMainWindow):
             # event.modifiers() can return KeyboardModifier(0) which may not equal
             # Qt.KeyboardModifier.NoModifier in direct comparison
             if not modifiers:
-                modifiers = Qt.KeyboardModifier.NoModifier
-
-            # Qt reports ShiftModifier for shifted symbols like $, %, etc.
-            # But these symbols can't be typed without Shift, so the Shift is implicit.
-            # Strip Shift for these keys to match user expectations.
-            shifted_symbol_keys = {
-                Qt.Key.Key_Exclam, Qt.Key.Key_At, Qt.Key.Key_NumberSign,
-                Qt.Key.Key_Dollar, Qt.Key.Key_Percent, Qt.Key.Key_AsciiCircum,
-                Qt.Key.Key_Ampersand, Qt.Key.Key_Asterisk, Qt.Key.Key_ParenLeft,
-                Qt.Key.Key_ParenRight, Qt.Key.Key_Underscore, Qt.Key.Key_Plus,
-                Qt.Key.Key_BraceLeft, Qt.Key.Key_BraceRight, Qt.Key.Key_Bar,
-                Qt.Key.Key_Colon, Qt.Key.Key_QuoteDbl, Qt.Key.Key_Less,
-                Qt.Key.Key_Greater, Qt.Key.Key_Question, Qt.Key.Key_AsciiTilde
-            }
-            if key in shifted_symbol_keys and modifiers & Qt.KeyboardModifier.ShiftModifier:
-                modifiers = modifiers & ~Qt.KeyboardModifier.ShiftModifier
+                modifiers = _NO_MODIFIER
+
+            # Strip the implicit Shift of shifted symbols to match user expectations.
+            if key in _SHIFTED_SYMBOL_KEYS and modifiers & _SHIFT_MODIFIER:
+                modifiers = modifiers & ~_SHIFT_MODIFIER
             
             viewer = self.get_current_viewer()
 
@@ -1886,14 +1948,7 @@ class DiffViewerTabWidget(QMainWindow):
                 if current_widget.is_escape_prefix_active():
                     # Ignore modifier-only key presses (Shift, Ctrl, Alt, Meta)
                     # These occur when pressing key combinations like Ctrl+Shift+Q
-                    modifier_keys = (
-                        Qt.Key.Key_Shift, Qt.Key.Key_Control,
-                        Qt.Key.Key_Alt, Qt.Key.Key_Meta,
-                        Qt.Key.Key_Super_L, Qt.Key.Key_Super_R,
-                        Qt.Key.Key_Hyper_L, Qt.Key.Key_Hyper_R,
-                        Qt.Key.Key_AltGr
-                    )
-                    if key in modifier_keys:
+                    if key in _TERMINAL_MODIFIER_KEYS:
                         return True  # Consume but don't clear prefix
 
                     # Clear the prefix state (reverts border)
@@ -17,12 +17,23 @@ from PyQt6.QtGui import QColor, QPainter, QFont, QTextCursor, QFontMetricsF, QPe
 from color_palettes import get_current_palette
 
 
+def visible_members(lines, first, end):
+    """Return the members of the set lines in [first, end).
+
+    Walks whichever is smaller: the set, or the range of visible lines.
+    """
+    if len(lines) <= end - first:
+        return [line for line in lines if first <= line < end]
+    return [line for line in range(int(first), int(end)) if line in lines]
+
+
 class LineNumberArea(QWidget):
     """Line number display with note markers"""
     
     def __init__(self, parent=None):
         super().__init__(parent)
         self.line_nums = []
+        self.line_labels = []  # Formatted line_nums, filled in as lines are painted
         self.line_backgrounds = {}
         self.noted_lines = set()
         self._font = None
@@ -39,6 +50,7 @@ class LineNumberArea(QWidget):
     
     def set_line_numbers(self, line_nums):
         self.line_nums = line_nums
+        self.line_labels = [None] * len(line_nums)
         self.update()
     
     def set_line_background(self, line_index, color):
@@ -61,6 +73,9 @@ class LineNumberArea(QWidget):
         first_visible_block = self.text_widget.firstVisibleBlock()
         viewport_height = self.height()
         current_block = first_visible_block
+        # Use system palette text color for dark mode compatibility
+        text_color = self.palette().color(self.palette().ColorRole.Text)
+        line_labels = self.line_labels
         
         while current_block.isValid():
             block_num = current_block.blockNumber()
@@ -80,9 +95,11 @@ class LineNumberArea(QWidget):
                                self.line_backgrounds[block_num])
             
             if line_num is not None:
-                # Use system palette text color for dark mode compatibility
-                painter.setPen(self.palette().color(self.palette().ColorRole.Text))
-                painter.drawText(10, y_pos + fm.ascent(), f"{line_num:6d} ")
+                label = line_labels[block_num]
+                if label is None:
+                    label = line_labels[block_num] = f"{line_num:6d} "
+                painter.setPen(text_color)
+                painter.drawText(10, y_pos + fm.ascent(), label)
             else:
                 painter.fillRect(0, y_pos, self.width(), line_height,
                                QColor("darkgray"))
@@ -168,6 +185,12 @@ class SyncedPlainTextEdit(QPlainTextEdit):
         
         self.setReadOnly(True)
         self.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
+        
+        # The text is never edited by the user, so don't make the
+        # document record undo commands for the many format changes
+        # made while highlighting.
+        self.document().setUndoRedoEnabled(False)
+        self.document().setMaximumBlockCount(0)  # Never discard lines
         self.setFocusPolicy(Qt.FocusPolicy.ClickFocus)
         self.setTabChangesFocus(False)  # Allow Tab key to be handled in keyPressEvent
         
@@ -297,35 +320,33 @@ class SyncedPlainTextEdit(QPlainTextEdit):
         # Draw bookmarked lines with left edge bar
         if self.bookmarked_lines:
             viewport_lines = self.viewport().height() // line_height if line_height > 0 else 0
-            for line_idx in self.bookmarked_lines:
-                if (line_idx >= first_visible and 
-                    line_idx < first_visible + viewport_lines):
+            for line_idx in visible_members(self.bookmarked_lines, first_visible,
+                                            first_visible + viewport_lines):
+                block = self.document().findBlockByNumber(line_idx)
+                if block.isValid():
+                    block_geom = self.blockBoundingGeometry(block)
+                    y_pos = int(block_geom.translated(self.contentOffset()).top())
+                    block_height = int(block_geom.height())
                     
-                    block = self.document().findBlockByNumber(line_idx)
-                    if block.isValid():
-                        block_geom = self.blockBoundingGeometry(block)
-                        y_pos = int(block_geom.translated(self.contentOffset()).top())
-                        block_height = int(block_geom.height())
-                        
-                        # Bright cyan vertical bar on left edge - 5px wide for visibility
-                        painter.fillRect(0, y_pos, 5, block_height, QColor(0, 255, 255))
+                    # Bright cyan vertical bar on left edge - 5px wide for visibility
+                    painter.fillRect(0, y_pos, 5, block_height, QColor(0, 255, 255))
         
         # Draw noted lines with background color
         if self.noted_lines:
             viewport_lines = self.viewport().height() // line_height if line_height > 0 else 0
-            for line_idx in self.noted_lines:
-                if (line_idx >= first_visible and 
-                    line_idx < first_visible + viewport_lines):
+            noted_line_bg = palette.get_color('noted_line_bg')
+            viewport_width = self.viewport().width()
+            for line_idx in visible_members(self.noted_lines, first_visible,
+                                            first_visible + viewport_lines):
+                block = self.document().findBlockByNumber(line_idx)
+                if block.isValid():
+                    block_geom = self.blockBoundingGeometry(block)
+                    y_pos = int(block_geom.translated(self.contentOffset()).top())
+                    block_height = int(block_geom.height())
                     
-                    block = self.document().findBlockByNumber(line_idx)
-                    if block.isValid():
-                        block_geom = self.blockBoundingGeometry(block)
-                        y_pos = int(block_geom.translated(self.contentOffset()).top())
-                        block_height = int(block_geom.height())
-                        
-                        # Light yellow/cream background for noted lines
-                        painter.fillRect(0, y_pos, self.viewport().width(), 
-                                       block_height, palette.get_color('noted_line_bg'))
+                    # Light yellow/cream background for noted lines
+                    painter.fillRect(0, y_pos, viewport_width,
+                                     block_height, noted_line_bg)
         
         # Draw current line indicator - blue if focused, gray if not
         if self.focused_line >= 0:
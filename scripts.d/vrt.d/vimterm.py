@@ -3,7 +3,7 @@
 # Licensed under Gnu GPL V3.
 #
 
-from PyQt6.QtCore import QTimer, Qt, pyqtSignal
+from PyQt6.QtCore import Qt, pyqtSignal
 from PyQt6.QtWidgets import QApplication
 from editerm import TerminalWidget
 import pty
@@ -38,11 +38,7 @@ class VimWidget(TerminalWidget):
                        {**os.environ, "TERM": "xterm-256color"})
 
         os.close(slave_fd)
-        self.process_pid = pid
-
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.read_output)
-        self.timer.start(50)
+        self.watch_process(pid)
 
     def save_buffer(self):
         """Save the current buffer by sending :w<Enter>"""
@@ -97,8 +93,6 @@ class VimWidget(TerminalWidget):
                 if text:
                     text = text.replace('\n', '\r')
                     os.write(self.master_fd, text.encode('utf-8'))
-                    for _ in range(10):
-                        self.read_output()
                 event.accept()
             else:
                 super().mousePressEvent(event)
@@ -28,6 +28,7 @@ class FileButton (object):
         self.modi_rel_path_ = modi_rel_path
         self.stats_display_ = True
         self.desc_          = None
+        self.prefetch_desc_ = None  # Made before the viewer is.
         self.stats_tab_     = options.arg_tab_label_stats
         self.stats_file_    = options.arg_file_label_stats
 
@@ -88,22 +89,30 @@ class FileButton (object):
     def tab_relpath(self):
         return self.modi_rel_path_
 
+    def set_prefetched_descriptor(self, desc):
+        self.prefetch_desc_ = desc
+
     def make_viewer(self, base, modi):
         viewer = diff_viewer.DiffViewer(base, modi,
                                         self.options_.arg_max_line_length,
                                         show_diff_map(self.options_),
-                                        show_line_numbers(self.options_))
-
-        self.desc_ = diffmgr.create_diff_descriptor(self.options_.afr_,
-                                                    self.options_.arg_verbose,
-                                                    self.options_.intraline_percent_,
-                                                    self.options_.arg_dump_ir,
-                                                    base, modi)
+                                        show_line_numbers(self.options_),
+                                        self.options_.arg_max_highlight_lines)
+
+        desc                = self.prefetch_desc_
+        self.prefetch_desc_ = None
+        if desc is None or self.options_.arg_verbose:
+            desc = diffmgr.create_diff_descriptor(self.options_.afr_,
+                                                  self.options_.arg_verbose,
+                                                  self.options_.intraline_percent_,
+                                                  self.options_.arg_dump_ir,
+                                                  base, modi)
+        self.desc_ = desc
         add_diff_to_viewer(self.desc_, viewer)
 
         return viewer
 
-    def add_viewer(self, tab_widget):
+    def diff_paths(self):
         url = self.options_.arg_dossier_url
         if url is not None:
             root_path = url
@@ -116,9 +125,13 @@ class FileButton (object):
         #  These relative pathnames can be converted into a URL, which
         #  requires '/'.
         #
-        base   = posixpath.join(root_path, "base.d", self.base_rel_path_)
-        modi   = posixpath.join(root_path, "modi.d", self.modi_rel_path_)
-        viewer = self.make_viewer(base, modi)
+        base = posixpath.join(root_path, "base.d", self.base_rel_path_)
+        modi = posixpath.join(root_path, "modi.d", self.modi_rel_path_)
+        return (base, modi)
+
+    def add_viewer(self, tab_widget):
+        (base, modi) = self.diff_paths()
+        viewer       = self.make_viewer(base, modi)
         tab_widget.add_viewer(viewer)
 
 
@@ -161,6 +174,7 @@ def generate(options, note):
                                                          options.intraline_percent_,
                                                          options.selected_palette_,
                                                          options.arg_dump_ir,
+                                                         options.arg_verbose,
                                                          options.arg_tab_label_stats,
                                                          options.arg_file_label_stats,
                                                          options.editor_class_,